@@ -1,12 +1,18 @@
 import streamlit as st
-import pandas as pd
-from google.cloud import firestore
-from google.oauth2 import service_account
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, time as datetime_time
 import json
-import io
+import tempfile
 import os
 import time
+import atexit
+import threading
+import catalogo
+import fila_local
+import metricas
+
+# pandas, Firestore e os módulos que dependem deles são importados sob demanda:
+# o caminho do operador não precisa deles para a primeira renderização.
 
 # --- CONFIGURAÇÃO ---
 st.set_page_config(page_title="Sistema Integrado Produção", layout="wide")
@@ -31,38 +37,74 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- CONEXÃO FIREBASE ---
-@st.cache_resource
-def get_db():
-    key_dict = dict(st.secrets["firebase"])
+def _criar_backend(key_dict):
+    from google.cloud import firestore
+    from google.oauth2 import service_account
+    import lotes
+    import repositorio
     creds = service_account.Credentials.from_service_account_info(key_dict)
-    return firestore.Client(credentials=creds, project=key_dict["project_id"])
+    db = firestore.Client(credentials=creds, project=key_dict["project_id"])
+    alocador = lotes.AlocadorLotes(db)
+    # Reservas órfãs são recuperadas em segundo plano: rede fora não impede a criação
+    alocador.recuperar_em_segundo_plano()
+    atexit.register(alocador.devolver)
+    repo = repositorio.RepositorioFirestore(db, alocador)
+    # Agregados sem 'reconstruido_em' (base anterior a eles) são reconstruídos uma vez
+    repo.preparar_indicadores_em_segundo_plano()
+    return repo
+
+class BackendPreguicoso:
+    # Cria o backend em segundo plano; uma falha (rede fora, credencial) não fica
+    # guardada: a próxima chamada tenta de novo
+    def __init__(self, key_dict):
+        self.key_dict = key_dict
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backend")
+        self._futuro = None
+
+    def iniciar(self):
+        with self._lock:
+            if self._futuro is None or (self._futuro.done() and self._futuro.exception() is not None):
+                self._futuro = self._pool.submit(_criar_backend, self.key_dict)
+            return self._futuro
+
+    def obter(self):
+        futuro = self.iniciar()
+        try: return futuro.result()
+        except Exception:
+            with self._lock:
+                if self._futuro is futuro: self._futuro = None
+            raise
+
+@st.cache_resource
+def _backend():
+    return BackendPreguicoso(dict(st.secrets["firebase"]))
+
+def get_repositorio():
+    return _backend().obter()
+
+@st.cache_resource
+def get_cache_pendentes():
+    import cache_producao
+    import repositorio
+    return cache_producao.CachePendentes(get_repositorio(), repositorio.TAMANHO_PAGINA_PENDENTES)
+
+@st.cache_resource
+def get_fila():
+    backend = _backend()
+    fila = fila_local.FilaLocal("fila_gravacoes.db", lambda itens: backend.obter().salvar(itens))
+    atexit.register(fila.parar)
+    return fila.iniciar()
 
 # --- FUNÇÕES ---
-def get_proximo_lote(db, cod_sap):
-    doc_ref = db.collection('controles').document('lotes_perfis')
-    doc = doc_ref.get()
-    
-    if not doc.exists:
-        doc_ref.set({})
-        dados = {}
-    else:
-        dados = doc.to_dict()
-        
-    sap_str = str(cod_sap)
-    ultimo = int(dados.get(sap_str, 0))
-    novo = ultimo + 1
-    
-    doc_ref.set({sap_str: novo}, merge=True)
-    return f"BRASA{novo:05d}"
+MAX_LINHAS_LOTE = 200
+ULTIMOS_LOTES_TELA = 5
 
-def salvar_no_firebase(dados):
-    db = get_db()
-    lote = get_proximo_lote(db, dados['cod_sap'])
-    
-    payload = {
-        "data_hora": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-        "timestamp": datetime.now(),
-        "lote": lote,
+def montar_payload(dados):
+    agora = datetime.now()
+    return {
+        "data_hora": agora.strftime("%d/%m/%Y %H:%M:%S"),
+        "timestamp": agora.isoformat(),
         "reserva": str(dados['reserva']),
         "status_reserva": "Pendente",
         "cod_sap": int(dados['cod_sap']),
@@ -74,9 +116,30 @@ def salvar_no_firebase(dados):
         "peso_teorico": float(dados['peso_teorico']),
         "sucata": float(dados['sucata'])
     }
-    
-    db.collection('perfis_producao').add(payload)
-    return lote
+
+def lembrar_envios(ids):
+    # Ids enfileirados nesta sessão, para mostrar os lotes quando o servidor confirmar
+    st.session_state.meus_envios = st.session_state.get('meus_envios', []) + list(ids)
+    return ids
+
+def registrar_producao(dados):
+    # Gravação local imediata; o envio ao Firestore é feito pela fila em segundo plano
+    return lembrar_envios([get_fila().enfileirar(montar_payload(dados))])[0]
+
+def registrar_producao_lote(reserva, item, pecas):
+    # Todas as peças vão num único grupo da fila: um commit e lotes BRASA contíguos
+    lista = [montar_payload({
+        'reserva': reserva,
+        'cod_sap': item['Cód. SAP'],
+        'descricao': item['Descrição'],
+        'qtd': p['Qtd'],
+        'peso_real': p['Peso Real (kg)'],
+        'tamanho_real_mm': p['Comp. Real (mm)'],
+        'tamanho_corte_mm': p['Comp. Corte (mm)'],
+        'peso_teorico': p['Peso Teórico (kg)'],
+        'sucata': p['Sucata (kg)']
+    }) for p in pecas.to_dict('records')]
+    return lembrar_envios(get_fila().enfileirar_grupo(lista))
 
 def formatar_br(v):
     try: return f"{float(v):,.3f}".replace(",", "X").replace(".", ",").replace("X", ".")
@@ -86,73 +149,72 @@ def regra_corte(mm):
     try: return (int(float(mm)) // 500) * 500
     except: return 0
 
-@st.cache_data
+def calcular_pecas(df, fator):
+    # regra_corte + peso teórico + sucata para todas as linhas da entrada em lote
+    import pandas as pd
+    qtd = pd.to_numeric(df['Qtd'], errors='coerce').fillna(0).astype(int)
+    peso = pd.to_numeric(df['Peso Real (kg)'], errors='coerce').fillna(0.0).astype(float)
+    comp = pd.to_numeric(df['Comp. Real (mm)'], errors='coerce').fillna(0).astype(int)
+    corte = (comp // 500) * 500
+    pt = (corte / 1000.0) * fator * qtd
+    return pd.DataFrame({
+        'Qtd': qtd,
+        'Peso Real (kg)': peso,
+        'Comp. Real (mm)': comp,
+        'Comp. Corte (mm)': corte,
+        'Peso Teórico (kg)': pt,
+        'Sucata (kg)': peso - pt
+    })
+
+@metricas.medir('catalogo.carregar')
 def carregar_base_sap():
-    path = "base_sap.xlsx"
-    if not os.path.exists(path): return None
-    try:
-        df = pd.read_excel(path, dtype=str)
-        df.columns = df.columns.str.strip().str.upper()
-        col_prod = next((c for c in df.columns if 'PRODUTO' in c), None)
-        col_peso = next((c for c in df.columns if 'PESO' in c and 'METRO' in c), None)
-        
-        if col_prod and col_peso:
-            df['PRODUTO'] = pd.to_numeric(df[col_prod], errors='coerce').fillna(0).astype(int)
-            def conv(x):
-                if pd.isna(x): return 0.0
-                s = str(x).strip()
-                if '.' in s and ',' in s: s = s.replace('.', '')
-                s = s.replace(',', '.')
-                try: return float(s)
-                except: return 0.0
-            df['PESO_FATOR'] = df[col_peso].apply(conv)
-            return df
-        return None
-    except: return None
+    return catalogo.carregar("base_sap.xlsx")
 
 # --- APP ---
+_inicio_execucao = time.perf_counter()
+try: _backend().iniciar()
+except Exception: pass
 st.sidebar.title("Acesso ao Sistema")
 perfil = st.sidebar.radio("Perfil de Acesso:", ["Operador", "Administrador", "Super Admin"])
-df_sap = carregar_base_sap()
+base_sap = carregar_base_sap()
 
 # === OPERADOR ===
 if perfil == "Operador":
     st.title("Operador: Perfis")
-    if df_sap is not None:
+    if base_sap is not None:
         if 'wizard_data' not in st.session_state: st.session_state.wizard_data = {}
         if 'wizard_step' not in st.session_state: st.session_state.wizard_step = 0
         
+        # Avanço de etapa via callback: o estado muda antes do rerun do diálogo,
+        # então cada etapa custa um único rerun do fragmento
+        def avancar(campo, chave, proxima):
+            valor = st.session_state[chave]
+            if isinstance(valor, str) and not valor.strip():
+                st.session_state.wizard_erro = "Campo obrigatório."
+                return
+            st.session_state.wizard_data[campo] = valor
+            st.session_state.wizard_step = proxima
+        
         @st.dialog("Entrada de Dados")
         def wizard():
             st.write(f"**Item:** {st.session_state.wizard_data.get('Cód. SAP')}")
-            fator_oculto = float(st.session_state.wizard_data.get('PESO_FATOR', 0.0))
             
             st.markdown("---")
             if st.session_state.wizard_step == 1:
                 with st.form("f1"):
-                    res = st.text_input("1. Reserva:", key="w_res")
-                    if st.form_submit_button("PRÓXIMO"):
-                        if res.strip():
-                            st.session_state.wizard_data.update({'reserva': res, 'PESO_FATOR': fator_oculto})
-                            st.session_state.wizard_step = 2
-                            st.rerun()
-                        else: st.error("Campo obrigatório.")
+                    st.text_input("1. Reserva:", key="w_res")
+                    st.form_submit_button("PRÓXIMO", on_click=avancar, args=('reserva', 'w_res', 2))
+                if st.session_state.pop('wizard_erro', None): st.error("Campo obrigatório.")
             
             elif st.session_state.wizard_step == 2:
                 with st.form("f2"):
-                    qtd = st.number_input("2. Quantidade:", min_value=1, step=1)
-                    if st.form_submit_button("PRÓXIMO"):
-                        st.session_state.wizard_data['qtd'] = qtd
-                        st.session_state.wizard_step = 3
-                        st.rerun()
+                    st.number_input("2. Quantidade:", min_value=1, step=1, key="w_qtd")
+                    st.form_submit_button("PRÓXIMO", on_click=avancar, args=('qtd', 'w_qtd', 3))
             
             elif st.session_state.wizard_step == 3:
                 with st.form("f3"):
-                    peso = st.number_input("3. Peso Real (kg):", min_value=0.001, format="%.3f")
-                    if st.form_submit_button("PRÓXIMO"):
-                        st.session_state.wizard_data['peso_real'] = peso
-                        st.session_state.wizard_step = 4
-                        st.rerun()
+                    st.number_input("3. Peso Real (kg):", min_value=0.001, format="%.3f", key="w_peso")
+                    st.form_submit_button("PRÓXIMO", on_click=avancar, args=('peso_real', 'w_peso', 4))
             
             elif st.session_state.wizard_step == 4:
                 comp = st.number_input("4. Comprimento Real (mm):", min_value=0)
@@ -179,14 +241,13 @@ if perfil == "Operador":
                                 'sucata': sucata
                             }
                             try:
-                                lote = salvar_no_firebase(dados)
-                                st.toast(f"Lote {lote} registrado.")
+                                registrar_producao(dados)
+                                st.toast("Registro salvo. Envio ao sistema em andamento.")
                                 st.session_state.wizard_step = 0
                                 st.session_state.input_scanner = ""
-                                time.sleep(1)
                                 st.rerun()
                             except Exception as e:
-                                st.error(f"Erro de conexão: {e}")
+                                st.error(f"Erro ao gravar localmente: {e}")
                     else: st.error("Valor inválido.")
 
         def check():
@@ -194,222 +255,263 @@ if perfil == "Operador":
             if c:
                 try:
                     cod = int(str(c).strip().split(":")[-1])
-                    row = df_sap[df_sap['PRODUTO'] == cod]
-                    if not row.empty:
+                    item = base_sap.buscar(cod)
+                    if item is not None:
+                        descricao, fator = item
                         st.session_state.wizard_data = {
                             "Cód. SAP": cod,
-                            "Descrição": row.iloc[0]['DESCRIÇÃO DO PRODUTO'],
-                            "PESO_FATOR": float(row.iloc[0]['PESO_FATOR'])
+                            "Descrição": descricao,
+                            "PESO_FATOR": float(fator)
                         }
-                        st.session_state.wizard_step = 1
+                        if st.session_state.get('modo_entrada') == "Lote de peças":
+                            st.session_state.lote_ativo = True
+                        else:
+                            st.session_state.wizard_step = 1
                     else: st.toast("Código não encontrado.")
                 except: pass
                 st.session_state.input_scanner = ""
 
-        if st.session_state.wizard_step > 0: wizard()
-        st.text_input("Leitura SAP (Código):", key="input_scanner", on_change=check)
+        @st.dialog("Entrada em Lote", width="large")
+        def entrada_lote():
+            import pandas as pd
+            item = st.session_state.wizard_data
+            st.write(f"**Item:** {item.get('Cód. SAP')} - {item.get('Descrição')}")
+            reserva = st.text_input("Reserva:", key="l_res")
+            
+            linhas = st.data_editor(
+                pd.DataFrame({'Qtd': [1], 'Peso Real (kg)': [0.0], 'Comp. Real (mm)': [0]}),
+                num_rows="dynamic", use_container_width=True, key="l_linhas",
+                column_config={
+                    'Qtd': st.column_config.NumberColumn(min_value=1, step=1, required=True),
+                    'Peso Real (kg)': st.column_config.NumberColumn(min_value=0.0, format="%.3f", required=True),
+                    'Comp. Real (mm)': st.column_config.NumberColumn(min_value=0, step=1, required=True)
+                }
+            )
+            pecas = calcular_pecas(linhas.dropna(how='all'), float(item.get('PESO_FATOR', 0.0)))
+            validas = (pecas['Qtd'] >= 1) & (pecas['Peso Real (kg)'] > 0) & (pecas['Comp. Real (mm)'] > 0)
+            
+            st.dataframe(pecas, use_container_width=True, hide_index=True, column_config={
+                c: st.column_config.NumberColumn(format="%.3f") for c in ['Peso Real (kg)', 'Peso Teórico (kg)', 'Sucata (kg)']
+            })
+            st.info(f"**{len(pecas)} linha(s)** | Peso teórico: **{formatar_br(pecas['Peso Teórico (kg)'].sum())} kg** | Sucata: **{formatar_br(pecas['Sucata (kg)'].sum())} kg**")
+            
+            if st.button("GRAVAR LOTE", type="primary"):
+                if not reserva.strip(): st.error("Reserva obrigatória.")
+                elif pecas.empty or not validas.all(): st.error("Há linhas com valores inválidos.")
+                elif len(pecas) > MAX_LINHAS_LOTE: st.error(f"Máximo de {MAX_LINHAS_LOTE} linhas por lote.")
+                else:
+                    try:
+                        registrar_producao_lote(reserva, item, pecas)
+                        st.toast(f"{len(pecas)} registros salvos. Envio ao sistema em andamento.")
+                        st.session_state.lote_ativo = False
+                        st.session_state.input_scanner = ""
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Erro ao gravar localmente: {e}")
+        
+        # Leitura e assistente num fragmento: cada bipe/etapa reexecuta só este trecho
+        @st.fragment
+        @metricas.medir('operador.leitura')
+        def leitura():
+            st.radio("Modo de entrada:", ["Peça a peça", "Lote de peças"], horizontal=True, key="modo_entrada")
+            if st.session_state.wizard_step > 0: wizard()
+            elif st.session_state.get('lote_ativo'): entrada_lote()
+            st.text_input("Leitura SAP (Código):", key="input_scanner", on_change=check)
+        
+        # Situação da fila e lotes gerados para os registros desta sessão; enquanto
+        # houver registro sem lote confirmado, o trecho se atualiza sozinho
+        @st.fragment(run_every=2 if st.session_state.get('meus_envios') else None)
+        def envios():
+            fila = get_fila()
+            n_fila = fila.tamanho()
+            esperando = st.session_state.get('meus_envios', [])
+            if esperando:
+                confirmados = fila.lotes_confirmados(esperando)
+                novos = [confirmados[i] for i in esperando if i in confirmados]
+                st.session_state.meus_lotes = (st.session_state.get('meus_lotes', []) + novos)[-ULTIMOS_LOTES_TELA:]
+                # Fila vazia: o que não voltou confirmado já saiu da memória da fila
+                st.session_state.meus_envios = [i for i in esperando if i not in confirmados] if n_fila else []
+            if n_fila:
+                aviso = f"Fila local: {n_fila} registro(s) aguardando envio."
+                if fila.ultimo_erro: aviso += " Sem conexão com o servidor, nova tentativa automática."
+                st.caption(aviso)
+            if st.session_state.get('meus_lotes'):
+                st.caption("Últimos lotes gerados: " + ", ".join(reversed(st.session_state.meus_lotes)))
+        
+        leitura()
+        envios()
 
 # === ADMIN ===
 elif perfil == "Administrador":
     st.title("Painel Administrativo")
     if st.sidebar.text_input("Senha", type="password") == "Br@met4l":
-        if st.button("Atualizar Página"): st.rerun()
+        import pandas as pd
+        import exportacao
+        repo = get_repositorio()
+        cache = get_cache_pendentes()
         
-        db = get_db()
-        docs = db.collection('perfis_producao').order_by('timestamp', direction=firestore.Query.DESCENDING).limit(1000).stream()
-        lista = [d.to_dict() | {'id_doc': d.id} for d in docs]
-        df = pd.DataFrame(lista)
+        if st.button("Atualizar Página"):
+            cache.invalidar()
+            st.session_state.pop('fila_pendentes', None)
+            st.rerun()
         
-        if not df.empty:
-            df_pendentes = df[df['status_reserva'] == 'Pendente'].copy()
-            
-            tab1, tab2 = st.tabs(["Fila de Lançamentos", "Relatórios e Exportação"])
+        # Fila de pendentes do cache do processo (cache_producao), paginada por cursor no
+        # servidor. A sessão guarda só quantas páginas exibe; se a contagem mudar, volta à 1ª.
+        def carregar_mais_pendentes():
+            st.session_state.fila_pendentes['paginas'] += 1
+        
+        total_pendentes = cache.contar()
+        fila = st.session_state.get('fila_pendentes')
+        if fila is None or fila['total'] != total_pendentes:
+            fila = st.session_state.fila_pendentes = {'paginas': 1, 'total': total_pendentes}
+        regs_tela, ha_mais = cache.visao(total_pendentes, fila['paginas'])
+        
+        tab1, tab2 = st.tabs(["Fila de Lançamentos", "Relatórios e Exportação"])
+        
+        with tab1:
+            st.subheader("Lotes Pendentes de Lançamento no SAP")
             
-            with tab1:
-                st.subheader("Lotes Pendentes de Lançamento no SAP")
+            if regs_tela:
+                df_pendentes = pd.DataFrame(regs_tela)
+                df_view = df_pendentes[['lote', 'reserva', 'cod_sap', 'descricao', 'qtd', 'peso_teorico', 'data_hora']]
+                df_view.columns = ['Lote', 'Reserva', 'Cód. SAP', 'Descrição', 'Qtd', 'Peso (kg)', 'Data/Hora']
+                st.dataframe(df_view, use_container_width=True, hide_index=True)
+                st.caption(f"Exibindo {len(df_pendentes)} de {total_pendentes} lotes pendentes.")
+                if ha_mais:
+                    st.button("Carregar Mais Lotes", on_click=carregar_mais_pendentes)
                 
-                if not df_pendentes.empty:
-                    df_view = df_pendentes[['lote', 'reserva', 'cod_sap', 'descricao', 'qtd', 'peso_teorico', 'data_hora']]
-                    df_view.columns = ['Lote', 'Reserva', 'Cód. SAP', 'Descrição', 'Qtd', 'Peso (kg)', 'Data/Hora']
-                    st.dataframe(df_view, use_container_width=True, hide_index=True)
-                    
-                    # Preparação do Excel apenas com os dados visíveis na tela
-                    lst_export_pendentes = []
-                    for _, r in df_pendentes.iterrows():
-                        lst_export_pendentes.append({
-                            'Lote': r['lote'],
-                            'Reserva': r['reserva'],
-                            'SAP': r['cod_sap'],
-                            'Descrição': r['descricao'],
-                            'Status': r['status_reserva'],
-                            'Qtd': int(r['qtd']),
-                            'Peso Lançamento (kg)': float(r['peso_teorico']),
-                            'Comp. Real': int(r['tamanho_real_mm']),
-                            'Comp. Corte': int(r['tamanho_corte_mm']),
-                            'Data/Hora': r['data_hora']
-                        })
-                        if float(r['sucata']) > 0.001:
-                            lst_export_pendentes.append({
-                                'Lote': 'VIRTUAL',
-                                'Reserva': r['reserva'],
-                                'SAP': r['cod_sap'],
-                                'Descrição': f"SUCATA - {r['descricao']}",
-                                'Status': r['status_reserva'],
-                                'Qtd': 1,
-                                'Peso Lançamento (kg)': float(r['sucata']),
-                                'Comp. Real': 0,
-                                'Comp. Corte': 0,
-                                'Data/Hora': r['data_hora']
-                            })
-                    
-                    df_export_pendentes = pd.DataFrame(lst_export_pendentes)
-                    b_pendentes = io.BytesIO()
-                    with pd.ExcelWriter(b_pendentes, engine='openpyxl') as w:
-                        df_export_pendentes.to_excel(w, index=False, sheet_name='Pendentes')
-                        ws = w.sheets['Pendentes']
-                        col_indices = [i+1 for i, c in enumerate(df_export_pendentes.columns) if 'peso' in c.lower() or 'sucata' in c.lower()]
-                        for r in range(2, ws.max_row + 1):
-                            for c in col_indices:
-                                ws.cell(row=r, column=c).number_format = '#,##0.000'
-                    
-                    st.markdown("<br>", unsafe_allow_html=True)
-                    col_btn1, col_btn2 = st.columns(2)
-                    
-                    with col_btn1:
-                        st.download_button("Baixar Excel (Apenas Lotes da Tela)", b_pendentes.getvalue(), "Lotes_Pendentes.xlsx", "secondary", use_container_width=True)
-                    
-                    with col_btn2:
-                        if st.button("Arquivar Todos os Lotes Pendentes", type="primary", use_container_width=True):
-                            with st.spinner("Processando..."):
-                                for _, row in df_pendentes.iterrows():
-                                    db.collection('perfis_producao').document(row['id_doc']).update({'status_reserva': 'Ok - Lançada'})
-                            st.success("Lotes arquivados com sucesso.")
-                            time.sleep(1)
-                            st.rerun()
-                else:
-                    st.info("Não há lotes pendentes no momento.")
-                    
-                st.markdown("---")
-                with st.expander("Excluir Registro Específico"):
-                    id_del_admin = st.text_input("Insira o ID do Sistema para exclusão:")
-                    if st.button("Confirmar Exclusão"):
-                        if id_del_admin:
-                            try:
-                                db.collection('perfis_producao').document(id_del_admin).delete()
-                                st.success("Registro excluído.")
-                                time.sleep(1)
-                                st.rerun()
-                            except: st.error("Erro na operação.")
-
-            with tab2:
-                st.subheader("Indicadores de Produção (Últimos 1000 registros)")
-                c1,c2,c3 = st.columns(3)
-                c1.metric("Volume de Itens", len(df))
-                c2.metric("Peso Total (kg)", formatar_br(df['peso_real'].sum()))
-                c3.metric("Sucata Total (kg)", formatar_br(df['sucata'].sum()))
+                st.markdown("<br>", unsafe_allow_html=True)
+                col_btn1, col_btn2 = st.columns(2)
                 
-                st.markdown("---")
-                st.subheader("Exportação de Dados (Histórico Completo)")
-                st.info("Selecione o período para gerar o relatório consolidado de todos os lotes (pendentes e arquivados).")
+                with col_btn1:
+                    # Excel só dos lotes da tela, gerado no clique (memorizado por conteúdo)
+                    st.download_button("Baixar Excel (Apenas Lotes da Tela)", lambda: exportacao.xlsx_memorizado(regs_tela, 'Pendentes'), "Lotes_Pendentes.xlsx", "secondary", use_container_width=True)
                 
-                col_d1, col_d2 = st.columns(2)
-                data_inicio = col_d1.date_input("Data Inicial", datetime.today())
-                data_fim = col_d2.date_input("Data Final", datetime.today())
+                # Arquiva exatamente os registros exibidos/exportados na renderização anterior,
+                # mesmo que a fila tenha sido recarregada depois (ex.: chegou um lote novo)
+                with col_btn2:
+                    if st.button("Arquivar Todos os Lotes da Tela", type="primary", use_container_width=True):
+                        registros_arquivar = st.session_state.get('pendentes_exibidos', regs_tela)
+                        barra = st.progress(0.0, text="Processando...")
+                        try:
+                            ok, falhas = repo.arquivar(
+                                registros_arquivar,
+                                progresso=lambda f, t: barra.progress(f / t, text=f"Arquivando {f}/{t}...")
+                            )
+                        except RuntimeError as e:
+                            st.error(str(e))
+                        else:
+                            cache.invalidar()
+                            st.session_state.pop('pendentes_exibidos', None)
+                            st.session_state.pop('fila_pendentes', None)
+                            if falhas:
+                                st.warning(f"{len(ok)} lotes arquivados. {len(falhas)} falharam e continuam pendentes.")
+                            else:
+                                st.success("Lotes arquivados com sucesso.")
+                            time.sleep(1)
+                            st.rerun()
+                st.session_state.pendentes_exibidos = regs_tela
+            else:
+                st.info("Não há lotes pendentes no momento.")
                 
-                if st.button("Gerar Relatório Excel (Histórico)"):
-                    with st.spinner("Extraindo dados..."):
-                        inicio_dt = datetime.combine(data_inicio, datetime_time.min)
-                        fim_dt = datetime.combine(data_fim, datetime_time.max)
-                        
-                        docs_export = db.collection('perfis_producao')\
-                                        .where('timestamp', '>=', inicio_dt)\
-                                        .where('timestamp', '<=', fim_dt)\
-                                        .order_by('timestamp', direction=firestore.Query.DESCENDING)\
-                                        .stream()
-                        
-                        lista_export = [d.to_dict() for d in docs_export]
+            st.markdown("---")
+            with st.expander("Excluir Registro Específico"):
+                id_del_admin = st.text_input("Insira o ID do Sistema para exclusão:")
+                if st.button("Confirmar Exclusão"):
+                    if id_del_admin:
+                        try:
+                            repo.excluir(id_del_admin)
+                            cache.invalidar()
+                            st.session_state.pop('fila_pendentes', None)
+                            st.success("Registro excluído.")
+                            time.sleep(1)
+                            st.rerun()
+                        except: st.error("Erro na operação.")
+
+        with tab2:
+            st.subheader("Indicadores de Produção (Acumulado)")
+            kpi = repo.indicadores_total()
+            c1,c2,c3 = st.columns(3)
+            c1.metric("Volume de Itens", int(kpi['registros']))
+            c2.metric("Peso Total (kg)", formatar_br(kpi['peso_real']))
+            c3.metric("Sucata Total (kg)", formatar_br(kpi['sucata']))
+            
+            st.markdown("---")
+            st.subheader("Exportação de Dados (Histórico Completo)")
+            st.info("Selecione o período para gerar o relatório consolidado de todos os lotes (pendentes e arquivados).")
+            
+            col_d1, col_d2 = st.columns(2)
+            data_inicio = col_d1.date_input("Data Inicial", datetime.today())
+            data_fim = col_d2.date_input("Data Final", datetime.today())
+            
+            kpi_periodo = repo.indicadores_periodo(data_inicio, data_fim)
+            c1,c2,c3 = st.columns(3)
+            c1.metric("Itens no Período", int(kpi_periodo['registros']))
+            c2.metric("Peso no Período (kg)", formatar_br(kpi_periodo['peso_real']))
+            c3.metric("Sucata no Período (kg)", formatar_br(kpi_periodo['sucata']))
+            
+            if st.button("Gerar Relatório Excel (Histórico)"):
+                with st.spinner("Extraindo dados..."):
+                    inicio_dt = datetime.combine(data_inicio, datetime_time.min)
+                    fim_dt = datetime.combine(data_fim, datetime_time.max)
+                    
+                    # Páginas por cursor -> linhas -> xlsx write-only em arquivo temporário
+                    fd, caminho_tmp = tempfile.mkstemp(suffix=".xlsx")
+                    os.close(fd)
+                    try:
+                        paginas = repo.periodo(inicio_dt, fim_dt)
+                        total = exportacao.gerar_xlsx(exportacao.paginas_export(paginas), 'Relatorio', caminho_tmp)
                         
-                        if not lista_export:
+                        if total == 0:
                             st.warning("Nenhum registro encontrado no período selecionado.")
                         else:
-                            df_export = pd.DataFrame(lista_export)
-                            lst_final_excel = []
-                            
-                            for _, r in df_export.iterrows():
-                                lst_final_excel.append({
-                                    'Lote': r.get('lote', ''),
-                                    'Reserva': r.get('reserva', ''),
-                                    'SAP': r.get('cod_sap', ''),
-                                    'Descrição': r.get('descricao', ''),
-                                    'Status': r.get('status_reserva', ''),
-                                    'Qtd': int(r.get('qtd', 0)),
-                                    'Peso Lançamento (kg)': float(r.get('peso_teorico', 0)),
-                                    'Comp. Real': int(r.get('tamanho_real_mm', 0)),
-                                    'Comp. Corte': int(r.get('tamanho_corte_mm', 0)),
-                                    'Data/Hora': r.get('data_hora', '')
-                                })
-                                if float(r.get('sucata', 0)) > 0.001:
-                                    lst_final_excel.append({
-                                        'Lote': 'VIRTUAL',
-                                        'Reserva': r.get('reserva', ''),
-                                        'SAP': r.get('cod_sap', ''),
-                                        'Descrição': f"SUCATA - {r.get('descricao', '')}",
-                                        'Status': r.get('status_reserva', ''),
-                                        'Qtd': 1,
-                                        'Peso Lançamento (kg)': float(r.get('sucata', 0)),
-                                        'Comp. Real': 0,
-                                        'Comp. Corte': 0,
-                                        'Data/Hora': r.get('data_hora', '')
-                                    })
-                            
-                            df_final = pd.DataFrame(lst_final_excel)
-                            b = io.BytesIO()
-                            with pd.ExcelWriter(b, engine='openpyxl') as w:
-                                df_final.to_excel(w, index=False, sheet_name='Relatorio')
-                                ws = w.sheets['Relatorio']
-                                col_indices = [i+1 for i, c in enumerate(df_final.columns) if 'peso' in c.lower() or 'sucata' in c.lower()]
-                                for r in range(2, ws.max_row + 1):
-                                    for c in col_indices:
-                                        ws.cell(row=r, column=c).number_format = '#,##0.000'
-                            
                             st.success("Relatório histórico gerado.")
                             nome_arquivo = f"Relatorio_Producao_{data_inicio.strftime('%d%m%Y')}.xlsx"
-                            st.download_button("Download Arquivo Excel", b.getvalue(), nome_arquivo, "primary")
-
-        else: st.info("Banco de dados vazio.")
+                            with open(caminho_tmp, 'rb') as arquivo:
+                                st.download_button("Download Arquivo Excel", arquivo, nome_arquivo, "primary")
+                    finally:
+                        os.remove(caminho_tmp)
     else: st.error("Credenciais inválidas.")
 
 # === SUPER ADMIN ===
 elif perfil == "Super Admin":
     st.title("Super Administrador")
     if st.sidebar.text_input("Senha", type="password") == "Workaround&97146605":
-        db = get_db()
+        import pandas as pd
+        import arquivo_frio
+        repo = get_repositorio()
         
-        tab_a, tab_b, tab_c = st.tabs(["Reset Geral", "Ajuste de Lotes", "Exclusão Manual"])
+        tab_a, tab_b, tab_c, tab_d, tab_e, tab_f = st.tabs(["Reset Geral", "Ajuste de Lotes", "Exclusão Manual", "Indicadores", "Desempenho", "Camada Fria"])
         
         with tab_a:
             st.warning("ATENÇÃO: Operação destrutiva. Apaga todos os dados de produção.")
+            if repo.expurgo_pendente():
+                st.error("Há uma limpeza interrompida. Execute novamente para concluir.")
             if st.button("APAGAR BANCO DE DADOS", type="primary"):
-                docs = db.collection('perfis_producao').stream()
-                for d in docs: d.reference.delete()
-                db.collection('controles').document('lotes_perfis').delete()
-                st.success("Banco de dados limpo com sucesso.")
-                time.sleep(1)
-                st.rerun()
+                barra = st.progress(0.0, text="Apagando registros...")
+                apagados, falhas = repo.expurgar(
+                    progresso=lambda n, t: barra.progress(min(1.0, n / max(t, 1)), text=f"Apagando registros {n}/{t}...")
+                )
+                get_cache_pendentes().invalidar()
+                if falhas:
+                    st.error(f"{len(falhas)} registros não foram apagados. Execute novamente para concluir.")
+                else:
+                    st.success("Banco de dados limpo com sucesso.")
+                    time.sleep(1)
+                    st.rerun()
         
         with tab_b:
             st.subheader("Gerenciamento de Contadores de Lote")
-            doc = db.collection('controles').document('lotes_perfis').get()
-            if doc.exists:
-                data = doc.to_dict()
-                df_lotes = pd.DataFrame(list(data.items()), columns=['Código SAP', 'Último Lote Gerado'])
+            data = repo.contadores()
+            if data:
+                df_lotes = pd.DataFrame(list(data.items()), columns=['Código SAP', 'Último Lote Reservado'])
                 st.dataframe(df_lotes, use_container_width=True)
                 
                 c1, c2 = st.columns(2)
                 sap = c1.number_input("SAP para alteração:", step=1, format="%d")
                 val = c2.number_input("Novo Valor Inicial:", step=1)
                 if c2.button("Atualizar Contador"):
-                    db.collection('controles').document('lotes_perfis').set({str(sap): val}, merge=True)
+                    repo.ajustar_contador(sap, val)
                     st.success("Contador atualizado.")
                     time.sleep(1)
                     st.rerun()
@@ -422,6 +524,60 @@ elif perfil == "Super Admin":
             if st.button("Executar Exclusão"):
                 if id_manual:
                     try:
-                        db.collection('perfis_producao').document(id_manual).delete()
+                        repo.excluir(id_manual)
                         st.success("Documento deletado com sucesso.")
                     except: st.error("Falha na execução.")
+        
+        with tab_d:
+            st.subheader("Reconciliação dos Indicadores")
+            st.info("Recalcula os agregados de produção (total, por dia e por SAP) a partir dos registros brutos.")
+            st.caption("Durante a reconstrução, gravações ficam retidas na fila local dos operadores e arquivamentos/exclusões são recusados.")
+            if st.button("Reconstruir Indicadores"):
+                try:
+                    with st.spinner("Recalculando indicadores..."):
+                        lidos = repo.reconstruir_indicadores()
+                    st.success(f"Indicadores reconstruídos a partir de {lidos} registros.")
+                except RuntimeError as e: st.error(str(e))
+        
+        with tab_e:
+            st.subheader("Desempenho do Processo")
+            st.info("Tempos das últimas execuções de cada operação instrumentada (desde o início deste processo).")
+            linhas = metricas.resumo()
+            if linhas:
+                df_met = pd.DataFrame(linhas)
+                df_met['ultima'] = pd.to_datetime(df_met['ultima'], unit='s').dt.strftime('%d/%m/%Y %H:%M:%S')
+                df_met.columns = ['Operação', 'Execuções', 'Erros', 'Média (ms)', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Máx. (ms)', 'Última']
+                st.dataframe(df_met.style.format(precision=1), use_container_width=True, hide_index=True)
+            else: st.info("Nenhuma medição registrada ainda.")
+            
+            c1, c2 = st.columns(2)
+            if c1.button("Zerar Medições"):
+                metricas.limpar()
+                st.rerun()
+            if os.environ.get('METRICAS_PROM') and c2.button("Gravar Arquivo Prometheus"):
+                destino = metricas.gravar_prometheus()
+                if destino: st.success(f"Métricas gravadas em {destino}.")
+                else: st.error("Falha ao gravar o arquivo de métricas.")
+        
+        with tab_f:
+            st.subheader("Compactação de Lotes Lançados")
+            st.info("Move lotes 'Ok - Lançada' antigos do Firestore para arquivos mensais locais. Relatórios e indicadores continuam incluindo esses registros.")
+            partes = repo.resumo_frio()
+            if partes:
+                df_frio = pd.DataFrame(partes)
+                df_frio['bytes'] = df_frio['bytes'] / (1024 * 1024)
+                df_frio.columns = ['Mês', 'Registros', 'Peso Real (kg)', 'Tamanho (MB)']
+                st.dataframe(df_frio.style.format(precision=2), use_container_width=True, hide_index=True)
+            else: st.info("Nenhum registro na camada fria.")
+            
+            configurada = repo.frio_configurado()
+            if not configurada:
+                st.warning("Compactação desativada: defina a variável de ambiente ARQUIVO_FRIO_DIR com uma pasta persistente do servidor (fora do diretório do app) e reinicie a aplicação.")
+            dias = st.number_input("Compactar lotes lançados há mais de (dias):", min_value=1, value=arquivo_frio.DIAS_QUENTE, step=1, disabled=not configurada)
+            if st.button("Compactar Agora", disabled=not configurada):
+                aviso = st.empty()
+                movidos, falhas = repo.compactar(int(dias), progresso=lambda n: aviso.info(f"{n} registros movidos..."))
+                if falhas: st.warning(f"{movidos} registros movidos. {len(falhas)} continuam no Firestore; execute novamente.")
+                else: st.success(f"{movidos} registros movidos para a camada fria.")
+
+metricas.registrar('app.execucao', time.perf_counter() - _inicio_execucao)
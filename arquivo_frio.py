@@ -0,0 +1,183 @@
+import os
+import glob
+import heapq
+import sqlite3
+import argparse
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import metricas
+
+# --- CAMADA FRIA (ARQUIVO MENSAL) ---
+# Lotes já lançados ('Ok - Lançada') e antigos saem de perfis_producao e vão para
+# um SQLite por mês (AAAA-MM.db) com índice por timestamp. Consultas por período
+# só abrem os meses que intersectam o intervalo. A gravação é idempotente (id_doc
+# é chave), então uma compactação interrompida pode ser simplesmente repetida.
+# Timestamps ficam em UTC sem fuso, mesma convenção do Firestore.
+# A pasta precisa ser definida explicitamente (ARQUIVO_FRIO_DIR ou --pasta) e ser
+# persistente: registros compactados deixam de existir no Firestore. Sem pasta a
+# camada fria fica desligada: consultas não encontram nada e a gravação é recusada.
+
+PASTA_PADRAO = os.environ.get('ARQUIVO_FRIO_DIR') or None
+ERRO_SEM_PASTA = "Camada fria desativada: defina ARQUIVO_FRIO_DIR com uma pasta persistente."
+DIAS_QUENTE = 90
+FORMATO_TS = '%Y-%m-%d %H:%M:%S.%f'
+COLUNAS = [
+    ('id_doc', 'TEXT PRIMARY KEY'),
+    ('timestamp', 'TEXT NOT NULL'),
+    ('gravado_em', 'TEXT'),
+    ('data_hora', 'TEXT'),
+    ('lote', 'TEXT'),
+    ('reserva', 'TEXT'),
+    ('status_reserva', 'TEXT'),
+    ('cod_sap', 'INTEGER'),
+    ('descricao', 'TEXT'),
+    ('qtd', 'INTEGER'),
+    ('peso_real', 'REAL'),
+    ('tamanho_real_mm', 'INTEGER'),
+    ('tamanho_corte_mm', 'INTEGER'),
+    ('peso_teorico', 'REAL'),
+    ('sucata', 'REAL')
+]
+NOMES = [c for c, _ in COLUNAS]
+CAMPOS_TS = ('timestamp', 'gravado_em')
+
+def chave_ts(ts):
+    # datetime (com ou sem fuso) -> texto ordenável em UTC
+    if ts.tzinfo is not None: ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts.strftime(FORMATO_TS)
+
+def _ler_ts(texto):
+    return datetime.strptime(texto, FORMATO_TS).replace(tzinfo=timezone.utc) if texto else None
+
+def mesclar(*fontes, tamanho):
+    # Fontes em timestamp decrescente -> páginas em timestamp decrescente. Um registro
+    # presente nas duas camadas (compactação interrompida) sai uma vez só.
+    pagina, vistos, chave_atual = [], set(), None
+    for reg in heapq.merge(*fontes, key=lambda r: chave_ts(r['timestamp']), reverse=True):
+        chave = chave_ts(reg['timestamp'])
+        if chave != chave_atual: chave_atual, vistos = chave, set()
+        if reg['id_doc'] in vistos: continue
+        vistos.add(reg['id_doc'])
+        pagina.append(reg)
+        if len(pagina) >= tamanho:
+            yield pagina
+            pagina = []
+    if pagina: yield pagina
+
+class ArquivoFrio:
+    def __init__(self, pasta=PASTA_PADRAO):
+        self.pasta = pasta
+        self._lock = threading.Lock()
+
+    def configurada(self):
+        return bool(self.pasta)
+
+    def _caminho(self, mes):
+        return os.path.join(self.pasta, f"{mes}.db")
+
+    def _conectar(self, mes, criar=False):
+        caminho = self._caminho(mes)
+        if not criar and not os.path.exists(caminho): return None
+        os.makedirs(self.pasta, exist_ok=True)
+        conn = sqlite3.connect(caminho)
+        if criar:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS registros ({', '.join(f'{c} {t}' for c, t in COLUNAS)})")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON registros (timestamp)")
+        return conn
+
+    def meses(self):
+        if not self.configurada(): return []
+        padrao = os.path.join(self.pasta, '[0-9][0-9][0-9][0-9]-[0-9][0-9].db')
+        return sorted(os.path.splitext(os.path.basename(p))[0] for p in glob.glob(padrao))
+
+    def _podar(self, inicio=None, fim=None):
+        # Partições mensais que intersectam [inicio, fim]
+        de = chave_ts(inicio)[:7] if inicio else '0000-00'
+        ate = chave_ts(fim)[:7] if fim else '9999-99'
+        return [m for m in self.meses() if de <= m <= ate]
+
+    def _dict(self, linha):
+        reg = dict(zip(NOMES, linha))
+        for c in CAMPOS_TS: reg[c] = _ler_ts(reg[c])
+        return reg
+
+    @metricas.medir('frio.gravar')
+    def gravar(self, registros):
+        if not self.configurada(): raise RuntimeError(ERRO_SEM_PASTA)
+        por_mes = defaultdict(list)
+        for r in registros:
+            linha = [chave_ts(r[c]) if c in CAMPOS_TS and r.get(c) is not None else r.get(c) for c in NOMES]
+            por_mes[linha[1][:7]].append(linha)
+        sql = f"INSERT OR REPLACE INTO registros ({', '.join(NOMES)}) VALUES ({', '.join('?' * len(NOMES))})"
+        with self._lock:
+            for mes, linhas in por_mes.items():
+                conn = self._conectar(mes, criar=True)
+                try:
+                    with conn: conn.executemany(sql, linhas)
+                finally: conn.close()
+        return sum(len(l) for l in por_mes.values())
+
+    def remover(self, ids):
+        # Retorna os registros removidos (o id não diz o mês: percorre as partições)
+        ids = list(ids)
+        removidos = []
+        if not ids: return removidos
+        marcas = ",".join("?" * len(ids))
+        with self._lock:
+            for mes in self.meses():
+                conn = self._conectar(mes)
+                try:
+                    with conn:
+                        linhas = conn.execute(f"SELECT {', '.join(NOMES)} FROM registros WHERE id_doc IN ({marcas})", ids).fetchall()
+                        if linhas: conn.execute(f"DELETE FROM registros WHERE id_doc IN ({marcas})", ids)
+                finally: conn.close()
+                removidos.extend(self._dict(l) for l in linhas)
+        return removidos
+
+    def registros(self, inicio=None, fim=None, tamanho=500):
+        # Gera registros em timestamp decrescente, abrindo só os meses do período
+        de = chave_ts(inicio) if inicio else ''
+        ate = chave_ts(fim) if fim else '9999'
+        for mes in reversed(self._podar(inicio, fim)):
+            conn = self._conectar(mes)
+            if conn is None: continue
+            try:
+                cur = conn.execute(
+                    f"SELECT {', '.join(NOMES)} FROM registros WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp DESC",
+                    (de, ate)
+                )
+                while True:
+                    linhas = cur.fetchmany(tamanho)
+                    if not linhas: break
+                    for l in linhas: yield self._dict(l)
+            finally: conn.close()
+
+    def resumo(self):
+        linhas = []
+        for mes in self.meses():
+            conn = self._conectar(mes)
+            try: n, peso = conn.execute("SELECT COUNT(*), COALESCE(SUM(peso_real), 0) FROM registros").fetchone()
+            finally: conn.close()
+            linhas.append({'mes': mes, 'registros': n, 'peso_real': peso, 'bytes': os.path.getsize(self._caminho(mes))})
+        return linhas
+
+    def limpar(self):
+        with self._lock:
+            for mes in self.meses():
+                for sufixo in ('', '-journal', '-wal', '-shm'):
+                    try: os.remove(self._caminho(mes) + sufixo)
+                    except OSError: pass
+
+if __name__ == "__main__":
+    # Uso: GOOGLE_APPLICATION_CREDENTIALS=chave.json python arquivo_frio.py --dias 90
+    from google.cloud import firestore
+    import repositorio
+    parser = argparse.ArgumentParser(description="Move lotes lançados antigos para a camada fria.")
+    parser.add_argument('--dias', type=int, default=DIAS_QUENTE, help="idade mínima (dias) para sair do Firestore")
+    parser.add_argument('--pasta', default=PASTA_PADRAO, required=PASTA_PADRAO is None, help="obrigatória sem ARQUIVO_FRIO_DIR")
+    args = parser.parse_args()
+    repo = repositorio.RepositorioFirestore(firestore.Client(), None, ArquivoFrio(args.pasta))
+    movidos, falhas = repo.compactar(args.dias, progresso=lambda n: print(f"{n} registros movidos...", flush=True))
+    print(f"Registros movidos: {movidos} | falhas: {len(falhas)}")
@@ -0,0 +1,165 @@
+import io
+import os
+import time
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import tempfile
+
+import exportacao
+import fila_local
+import metricas
+import repositorio
+
+# --- BENCHMARK DOS CAMINHOS CRÍTICOS ---
+# Roda contra o RepositorioMemoria (latência configurável por ida ao servidor,
+# reservas de bloco de lotes e indicadores na escrita) e reporta vazão, latências
+# p50/p99 e idas ao servidor por cenário e volume de registros.
+#   gravacao_repositorio -> salvar() de um registro por commit (o envio da fila)
+#   gravacao_fila        -> o que o operador espera: gravação na fila SQLite; a
+#                           duração inclui o esvaziamento da fila em segundo plano
+# Uso: python benchmark.py --tamanhos 1000 10000 100000 --latencia-ms 20
+
+CENARIOS = ['gravacao_repositorio', 'gravacao_fila', 'painel', 'arquivar_todos', 'exportacao']
+
+def gerar_registros(n, fim=None):
+    fim = fim or datetime.now().replace(microsecond=0)
+    regs = []
+    for i in range(n):
+        ts = fim - timedelta(seconds=30 * (n - i))
+        qtd = random.randint(1, 10)
+        fator = random.uniform(1.0, 20.0)
+        corte = random.randint(1, 12) * 500
+        pt = corte / 1000.0 * fator * qtd
+        regs.append({
+            'id_doc': uuid.uuid4().hex,
+            'data_hora': ts.strftime("%d/%m/%Y %H:%M:%S"),
+            'timestamp': ts,
+            'gravado_em': ts.replace(tzinfo=timezone.utc),
+            'lote': f"BRASA{i + 1:05d}",
+            'reserva': str(random.randint(100000, 999999)),
+            'status_reserva': 'Pendente' if random.random() < 0.3 else 'Ok - Lançada',
+            'cod_sap': 1100000000 + random.randint(0, 500),
+            'descricao': 'PERFIL BENCHMARK',
+            'qtd': qtd,
+            'peso_real': pt + random.uniform(0, 2),
+            'tamanho_real_mm': corte + random.randint(0, 499),
+            'tamanho_corte_mm': corte,
+            'peso_teorico': pt,
+            'sucata': random.uniform(0, 2)
+        })
+    return regs
+
+def payload_operador():
+    agora = datetime.now()
+    return {
+        'data_hora': agora.strftime("%d/%m/%Y %H:%M:%S"),
+        'timestamp': agora.isoformat(),
+        'reserva': '123456',
+        'status_reserva': 'Pendente',
+        'cod_sap': 1100000002,
+        'descricao': 'PERFIL BENCHMARK',
+        'qtd': 2,
+        'peso_real': 10.5,
+        'tamanho_real_mm': 3120,
+        'tamanho_corte_mm': 3000,
+        'peso_teorico': 10.2,
+        'sucata': 0.3
+    }
+
+def _cronometrar(fn):
+    t = time.perf_counter()
+    r = fn()
+    return r, time.perf_counter() - t
+
+def bench_gravacao_repositorio(repo, amostras):
+    lat = []
+    for _ in range(amostras):
+        _, d = _cronometrar(lambda: repo.salvar([(uuid.uuid4().hex, payload_operador(), None)]))
+        lat.append(d)
+    return amostras, sum(lat), lat
+
+def bench_gravacao_fila(repo, amostras):
+    with tempfile.TemporaryDirectory() as pasta:
+        fila = fila_local.FilaLocal(os.path.join(pasta, 'fila.db'), repo.salvar, intervalo=0.01)
+        fila.iniciar()
+        t = time.perf_counter()
+        lat = [_cronometrar(lambda: fila.enfileirar(payload_operador()))[1] for _ in range(amostras)]
+        while fila.tamanho(): time.sleep(0.005)
+        duracao = time.perf_counter() - t
+        fila.parar()
+        fila._thread.join()
+    return amostras, duracao, lat
+
+def bench_painel(repo, amostras):
+    # Fila de pendentes: contagem + primeira página; nos reruns só a contagem é repetida
+    _, frio = _cronometrar(lambda: (repo.contar_pendentes(), repo.pendentes_pagina()))
+    lat = [frio]
+    for _ in range(amostras - 1):
+        lat.append(_cronometrar(repo.contar_pendentes)[1])
+    return amostras, sum(lat), lat
+
+def bench_arquivar_todos(repo, amostras):
+    registros, d_consulta = _cronometrar(repo.pendentes)
+    marcas = [time.perf_counter()]
+    ok, d = _cronometrar(lambda: repo.arquivar(registros, progresso=lambda f, t: marcas.append(time.perf_counter())))
+    lat = [b - a for a, b in zip(marcas, marcas[1:])]
+    return len(ok[0]), d_consulta + d, lat
+
+def bench_exportacao(repo, amostras):
+    fim = datetime.now() + timedelta(days=1)
+    inicio = fim - timedelta(days=3650)
+    lat, total = [], 0
+    marca = time.perf_counter()
+
+    def paginas():
+        nonlocal marca
+        for pagina in exportacao.paginas_export(repo.periodo(inicio, fim)):
+            yield pagina
+            agora = time.perf_counter()
+            lat.append(agora - marca)
+            marca = agora
+
+    t = time.perf_counter()
+    total = exportacao.gerar_xlsx(paginas(), 'Relatorio', io.BytesIO())
+    return total, time.perf_counter() - t, lat
+
+def executar(tamanhos, latencia_ms, amostras, cenarios):
+    resultados = []
+    for n in tamanhos:
+        registros = gerar_registros(n)
+        for cenario in cenarios:
+            # Repositório novo por cenário: arquivar altera o estado
+            repo = repositorio.RepositorioMemoria(latencia_ms=latencia_ms)
+            repo.semear(registros)
+            repo.idas = 0
+            itens, duracao, lat = globals()[f"bench_{cenario}"](repo, amostras)
+            resultados.append({
+                'cenario': cenario,
+                'registros': n,
+                'itens': itens,
+                'idas': repo.idas,
+                'duracao_s': duracao,
+                'vazao_s': itens / duracao if duracao else 0.0,
+                'p50_ms': metricas.percentil(lat, 50) * 1000,
+                'p99_ms': metricas.percentil(lat, 99) * 1000
+            })
+    return resultados
+
+def imprimir(resultados):
+    print(f"{'cenário':<22}{'registros':>10}{'itens':>9}{'idas':>8}{'duração (s)':>13}{'vazão (/s)':>13}{'p50 (ms)':>11}{'p99 (ms)':>11}")
+    for r in resultados:
+        print(f"{r['cenario']:<22}{r['registros']:>10}{r['itens']:>9}{r['idas']:>8}{r['duracao_s']:>13.3f}{r['vazao_s']:>13.1f}{r['p50_ms']:>11.2f}{r['p99_ms']:>11.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dos caminhos críticos (backend em memória).")
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--latencia-ms', type=float, default=0.0, help="latência simulada por ida ao servidor")
+    parser.add_argument('--amostras', type=int, default=200, help="operações medidas em gravacao_repositorio, gravacao_fila e painel")
+    parser.add_argument('--cenarios', nargs='+', choices=CENARIOS, default=CENARIOS)
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.semente)
+    imprimir(executar(args.tamanhos, args.latencia_ms, args.amostras, args.cenarios))
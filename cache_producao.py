@@ -0,0 +1,44 @@
+import time
+import threading
+
+# --- CACHE DO PAINEL ADMINISTRATIVO ---
+# Fila de pendentes compartilhada por todas as sessões do processo. A cada
+# execução do painel só a contagem de pendentes é lida no servidor; as páginas
+# (consulta paginada por cursor) só são relidas quando a contagem muda, quando
+# uma ação local (arquivar, excluir, expurgar) invalida o cache ou após
+# `validade_s` (alterações de outros processos que não mudam a contagem).
+
+class CachePendentes:
+    def __init__(self, repo, tamanho_pagina, validade_s=300):
+        self.repo = repo
+        self.tamanho_pagina = tamanho_pagina
+        self.validade = validade_s
+        self._lock = threading.Lock()
+        self._registros = []
+        self._cursor = None
+        self._total = None
+        self._carregado_em = 0.0
+
+    def _recarregar(self, total):
+        self._registros, self._cursor = self.repo.pendentes_pagina(self.tamanho_pagina)
+        self._total = total
+        self._carregado_em = time.monotonic()
+
+    def contar(self):
+        return self.repo.contar_pendentes()
+
+    def visao(self, total, paginas=1):
+        # total: contagem lida nesta execução (contar()); retorna os registros das
+        # `paginas` primeiras páginas e se há mais
+        with self._lock:
+            if total != self._total or time.monotonic() - self._carregado_em > self.validade:
+                self._recarregar(total)
+            quantidade = paginas * self.tamanho_pagina
+            while len(self._registros) < quantidade and self._cursor is not None:
+                regs, self._cursor = self.repo.pendentes_pagina(self.tamanho_pagina, self._cursor)
+                self._registros = self._registros + regs
+            return self._registros[:quantidade], len(self._registros) > quantidade or self._cursor is not None
+
+    def invalidar(self):
+        with self._lock:
+            self._total = None
@@ -0,0 +1,112 @@
+import os
+import pickle
+import hashlib
+import threading
+
+import metricas
+
+# --- CATÁLOGO SAP ---
+# A planilha é convertida uma única vez para um índice PRODUTO -> (descrição, fator)
+# salvo em cache binário ao lado do arquivo. O cache é validado pelo mtime/tamanho
+# e, se estes mudarem, pelo hash do conteúdo. pandas só é importado para recompilar.
+
+VERSAO_CACHE = 1
+
+_lock = threading.Lock()
+_memo = {}
+
+class CatalogoSAP:
+    def __init__(self, indice):
+        self.indice = indice
+
+    def __len__(self):
+        return len(self.indice)
+
+    def buscar(self, cod):
+        return self.indice.get(int(cod))
+
+def converter_numero_br(serie):
+    import pandas as pd
+    s = serie.fillna('').astype(str).str.strip()
+    milhar = s.str.contains('.', regex=False) & s.str.contains(',', regex=False)
+    s = s.where(~milhar, s.str.replace('.', '', regex=False))
+    s = s.str.replace(',', '.', regex=False)
+    return pd.to_numeric(s, errors='coerce').fillna(0.0).astype(float)
+
+def _hash_arquivo(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''): h.update(bloco)
+    return h.hexdigest()
+
+def caminho_cache(path):
+    pasta, nome = os.path.split(path)
+    return os.path.join(pasta, f".{os.path.splitext(nome)[0]}.cache.pkl")
+
+@metricas.medir('catalogo.compilar')
+def compilar_planilha(path):
+    import pandas as pd
+    df = pd.read_excel(path, dtype=str)
+    df.columns = df.columns.str.strip().str.upper()
+    col_prod = next((c for c in df.columns if 'PRODUTO' in c and 'DESCRI' not in c), None)
+    col_peso = next((c for c in df.columns if 'PESO' in c and 'METRO' in c), None)
+    col_desc = next((c for c in df.columns if 'DESCRI' in c), None)
+    if not (col_prod and col_peso and col_desc): return None
+
+    produtos = pd.to_numeric(df[col_prod], errors='coerce').fillna(0).astype('int64')
+    base = pd.DataFrame({
+        'PRODUTO': produtos,
+        'DESCRICAO': df[col_desc].fillna(''),
+        'PESO_FATOR': converter_numero_br(df[col_peso])
+    }).drop_duplicates('PRODUTO', keep='first')
+    return dict(zip(base['PRODUTO'].tolist(), zip(base['DESCRICAO'].tolist(), base['PESO_FATOR'].tolist())))
+
+def _ler_cache(path_cache, st, path):
+    try:
+        with open(path_cache, 'rb') as f: dados = pickle.load(f)
+    except Exception: return None, None
+    if dados.get('versao') != VERSAO_CACHE: return None, None
+    if dados.get('mtime') == st.st_mtime_ns and dados.get('tamanho') == st.st_size:
+        return dados['indice'], dados
+    if dados.get('hash') == _hash_arquivo(path):
+        return dados['indice'], dados
+    return None, dados
+
+def _gravar_cache(path_cache, dados):
+    tmp = f"{path_cache}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') as f: pickle.dump(dados, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path_cache)
+    except Exception:
+        try: os.remove(tmp)
+        except OSError: pass
+
+def carregar(path):
+    # Chamada barata: só um os.stat quando a planilha não mudou
+    try: st = os.stat(path)
+    except OSError: return None
+    chave = (st.st_mtime_ns, st.st_size)
+
+    with _lock:
+        memo = _memo.get(path)
+        if memo and memo[0] == chave: return memo[1]
+
+        path_cache = caminho_cache(path)
+        indice, dados = _ler_cache(path_cache, st, path)
+        if indice is not None and (dados['mtime'], dados['tamanho']) != chave:
+            _gravar_cache(path_cache, dados | {'mtime': st.st_mtime_ns, 'tamanho': st.st_size})
+        if indice is None:
+            try: indice = compilar_planilha(path)
+            except Exception: indice = None
+            if indice is None: return None
+            _gravar_cache(path_cache, {
+                'versao': VERSAO_CACHE,
+                'mtime': st.st_mtime_ns,
+                'tamanho': st.st_size,
+                'hash': _hash_arquivo(path),
+                'indice': indice
+            })
+
+        cat = CatalogoSAP(indice)
+        _memo[path] = (chave, cat)
+        return cat
@@ -0,0 +1,202 @@
+import io
+import os
+import time
+import hashlib
+import threading
+from itertools import islice
+from collections import OrderedDict, deque
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+import metricas
+
+# --- EXPORTAÇÃO ---
+# Cada registro gera uma linha principal e, quando há sucata (> 0,001 kg),
+# uma linha "VIRTUAL" logo abaixo. Tudo montado por colunas, sem iterrows().
+
+COLUNAS_EXPORT = ['Lote', 'Reserva', 'SAP', 'Descrição', 'Status', 'Qtd', 'Peso Lançamento (kg)', 'Comp. Real', 'Comp. Corte', 'Data/Hora']
+LIMITE_SUCATA = 0.001
+
+def _texto(df, col):
+    if col not in df.columns: return pd.Series('', index=df.index, dtype=object)
+    return df[col].astype(object).where(df[col].notna(), '')
+
+def _valor(df, col):
+    # Mantém colunas numéricas completas com o tipo original (ex.: cod_sap)
+    if col in df.columns and pd.api.types.is_numeric_dtype(df[col]) and df[col].notna().all(): return df[col]
+    return _texto(df, col)
+
+def _numero(df, col, tipo):
+    if col not in df.columns: return pd.Series(0, index=df.index).astype(tipo)
+    return pd.to_numeric(df[col], errors='coerce').fillna(0).astype(tipo)
+
+@metricas.medir('excel.montar_linhas')
+def montar_linhas_export(df):
+    if df is None or df.empty:
+        return pd.DataFrame({c: pd.Series(dtype=object) for c in COLUNAS_EXPORT})
+
+    df = df.reset_index(drop=True)
+    reserva, sap, desc = _texto(df, 'reserva'), _valor(df, 'cod_sap'), _texto(df, 'descricao')
+    status, data_hora = _texto(df, 'status_reserva'), _texto(df, 'data_hora')
+    sucata = _numero(df, 'sucata', 'float64')
+
+    principal = pd.DataFrame({
+        'Lote': _texto(df, 'lote'),
+        'Reserva': reserva,
+        'SAP': sap,
+        'Descrição': desc,
+        'Status': status,
+        'Qtd': _numero(df, 'qtd', 'int64'),
+        'Peso Lançamento (kg)': _numero(df, 'peso_teorico', 'float64'),
+        'Comp. Real': _numero(df, 'tamanho_real_mm', 'int64'),
+        'Comp. Corte': _numero(df, 'tamanho_corte_mm', 'int64'),
+        'Data/Hora': data_hora
+    })
+
+    tem_sucata = (sucata > LIMITE_SUCATA).to_numpy()
+    n_suc = int(tem_sucata.sum())
+    virtual = pd.DataFrame({
+        'Lote': pd.Series(['VIRTUAL'] * n_suc, dtype=object),
+        'Reserva': reserva[tem_sucata].to_numpy(),
+        'SAP': sap[tem_sucata].to_numpy(),
+        'Descrição': ('SUCATA - ' + desc[tem_sucata].astype(str)).to_numpy(dtype=object),
+        'Status': status[tem_sucata].to_numpy(),
+        'Qtd': np.ones(n_suc, dtype='int64'),
+        'Peso Lançamento (kg)': sucata[tem_sucata].to_numpy(),
+        'Comp. Real': np.zeros(n_suc, dtype='int64'),
+        'Comp. Corte': np.zeros(n_suc, dtype='int64'),
+        'Data/Hora': data_hora[tem_sucata].to_numpy()
+    })
+
+    # Intercala: linha principal na posição 2i, sucata em 2i+1
+    principal.index = np.arange(len(df)) * 2
+    virtual.index = np.flatnonzero(tem_sucata) * 2 + 1
+    return pd.concat([principal, virtual]).sort_index(kind='stable').reset_index(drop=True)
+
+# --- ESCRITA XLSX EM STREAMING ---
+FORMATO_PESO = '#,##0.000'
+TAMANHO_PAGINA = 500
+DIAS_FATIA = 7
+WORKERS_FATIAS = int(os.environ.get('EXPORT_WORKERS', 8))
+TENTATIVAS_FATIA = 3
+LIMITE_CACHE_XLSX = 8
+LIMITE_CACHE_BYTES = 64 * 1024 * 1024
+
+def paginar_consulta(consulta, tamanho=TAMANHO_PAGINA):
+    # Percorre a consulta (já ordenada) com cursores, uma página por vez
+    with metricas.cronometro('firestore.pagina'):
+        pagina = list(consulta.limit(tamanho).stream())
+    while pagina:
+        yield pagina
+        if len(pagina) < tamanho: break
+        with metricas.cronometro('firestore.pagina'):
+            pagina = list(consulta.start_after(pagina[-1]).limit(tamanho).stream())
+
+# --- BUSCA EM FATIAS PARALELAS ---
+# Períodos longos são divididos em fatias de tempo buscadas em paralelo. Como as
+# fatias são disjuntas e ordenadas, basta entregá-las em sequência para manter a
+# ordem decrescente; no máximo `workers` fatias ficam em memória ao mesmo tempo.
+
+def fatias_periodo(inicio, fim, dias=DIAS_FATIA):
+    # Intervalos [a, b) do mais recente para o mais antigo; o primeiro b inclui 'fim'
+    passo = timedelta(days=dias)
+    b = fim + timedelta(microseconds=1)
+    fatias = []
+    while b > inicio:
+        a = max(inicio, b - passo)
+        fatias.append((a, b))
+        b = a
+    return fatias
+
+def _buscar_com_retry(buscar, a, b, tentativas):
+    for t in range(tentativas):
+        try: return buscar(a, b)
+        except Exception:
+            if t == tentativas - 1: raise
+            time.sleep(0.5 * (2 ** t))
+
+def buscar_em_fatias(buscar, inicio, fim, dias=DIAS_FATIA, workers=WORKERS_FATIAS, tentativas=TENTATIVAS_FATIA):
+    # buscar(a, b) -> registros de [a, b) em timestamp decrescente; gera registros em ordem decrescente
+    fatias = iter(fatias_periodo(inicio, fim, dias))
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fatias") as pool:
+        em_voo = deque(pool.submit(_buscar_com_retry, buscar, a, b, tentativas) for a, b in islice(fatias, workers))
+        while em_voo:
+            regs = em_voo.popleft().result()
+            proxima = next(fatias, None)
+            if proxima: em_voo.append(pool.submit(_buscar_com_retry, buscar, *proxima, tentativas))
+            yield from regs
+
+def paginas_export(paginas):
+    # paginas: listas de dicts (ver Repositorio.periodo)
+    for pagina in paginas:
+        yield montar_linhas_export(pd.DataFrame(pagina))
+
+@metricas.medir('excel.gerar_xlsx')
+def gerar_xlsx(frames, sheet_name, destino):
+    # Workbook write-only: as linhas vão direto para disco, memória constante.
+    # O formato numérico é aplicado na escrita, sem varrer as células depois.
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    negrito = Font(bold=True)
+    cabecalho = None
+    total = 0
+    for frame in frames:
+        if cabecalho is None:
+            cabecalho = list(frame.columns)
+            cols_peso = {i for i, c in enumerate(cabecalho) if 'peso' in c.lower() or 'sucata' in c.lower()}
+            linha = []
+            for c in cabecalho:
+                cel = WriteOnlyCell(ws, value=c)
+                cel.font = negrito
+                linha.append(cel)
+            ws.append(linha)
+        for valores in frame.itertuples(index=False, name=None):
+            linha = []
+            for i, v in enumerate(valores):
+                if i in cols_peso:
+                    v = WriteOnlyCell(ws, value=v)
+                    v.number_format = FORMATO_PESO
+                linha.append(v)
+            ws.append(linha)
+            total += 1
+    if cabecalho is None: ws.append(COLUNAS_EXPORT)
+    wb.save(destino)
+    return total
+
+# --- EXCEL DE PENDENTES SOB DEMANDA ---
+# Gerado só quando alguém baixa, e memorizado pela impressão digital do conjunto
+# (ids + data de atualização). LRU limitada por quantidade e por bytes.
+_cache_xlsx = OrderedDict()
+_lock_cache = threading.Lock()
+
+def impressao_digital(registros):
+    h = hashlib.sha256()
+    for r in registros:
+        h.update(f"{r.get('id_doc')}|{r.get('atualizado_em') or r.get('gravado_em')}\n".encode())
+    return h.hexdigest()
+
+def _guardar(chave, dados):
+    with _lock_cache:
+        _cache_xlsx[chave] = dados
+        _cache_xlsx.move_to_end(chave)
+        while len(_cache_xlsx) > LIMITE_CACHE_XLSX or (len(_cache_xlsx) > 1 and sum(map(len, _cache_xlsx.values())) > LIMITE_CACHE_BYTES):
+            _cache_xlsx.popitem(last=False)
+
+def xlsx_memorizado(registros, sheet_name):
+    chave = f"{sheet_name}:{impressao_digital(registros)}"
+    with _lock_cache:
+        dados = _cache_xlsx.get(chave)
+        if dados is not None:
+            _cache_xlsx.move_to_end(chave)
+            return dados
+    destino = io.BytesIO()
+    gerar_xlsx([montar_linhas_export(pd.DataFrame(registros))], sheet_name, destino)
+    dados = destino.getvalue()
+    _guardar(chave, dados)
+    return dados
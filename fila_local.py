@@ -0,0 +1,146 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import metricas
+
+# --- FILA LOCAL DE GRAVAÇÕES ---
+# O operador grava primeiro em SQLite (modo WAL) e recebe confirmação imediata.
+# Uma thread em segundo plano envia a fila ao Firestore em lotes, com nova
+# tentativa e backoff exponencial. Cada item tem um id fixo (usado como id do
+# documento), então um envio repetido após falha de rede não duplica registros.
+# Itens de um mesmo grupo (entrada em lote) são sempre enviados juntos.
+# Os lotes devolvidos pelo servidor ficam em memória (os mais recentes) para a
+# tela do operador mostrar o número gerado de cada registro seu.
+
+LIMITE_CONFIRMADOS = 1000
+
+class FilaLocal:
+    def __init__(self, caminho, enviar, tamanho_lote=50, intervalo=0.5, backoff_max=60):
+        # enviar(itens): itens = [(id, dados, grupo)]; deve gravar tudo ou levantar exceção.
+        # Retorna [(id, lote)] dos itens confirmados.
+        self.enviar = enviar
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.backoff_max = backoff_max
+        self.ultimo_erro = None
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._confirmados = OrderedDict()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS fila (
+            id TEXT PRIMARY KEY,
+            dados TEXT NOT NULL,
+            criado_em REAL NOT NULL,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa REAL NOT NULL DEFAULT 0,
+            grupo TEXT
+        )""")
+
+    @metricas.medir('fila.enfileirar')
+    def enfileirar(self, dados):
+        id_item = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("INSERT INTO fila (id, dados, criado_em) VALUES (?, ?, ?)", (id_item, json.dumps(dados), time.time()))
+        self._evento.set()
+        return id_item
+
+    @metricas.medir('fila.enfileirar')
+    def enfileirar_grupo(self, lista_dados):
+        grupo = uuid.uuid4().hex
+        agora = time.time()
+        linhas = [(uuid.uuid4().hex, json.dumps(d), agora, grupo) for d in lista_dados]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT INTO fila (id, dados, criado_em, grupo) VALUES (?, ?, ?, ?)", linhas)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._evento.set()
+        return [l[0] for l in linhas]
+
+    def tamanho(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM fila").fetchone()[0]
+
+    def lotes_confirmados(self, ids):
+        # {id: lote} dos itens já gravados no servidor (entre os últimos LIMITE_CONFIRMADOS)
+        with self._lock:
+            return {i: self._confirmados[i] for i in ids if i in self._confirmados}
+
+    def _confirmar(self, pares):
+        with self._lock:
+            for i, lote in pares:
+                self._confirmados[i] = lote
+                self._confirmados.move_to_end(i)
+            while len(self._confirmados) > LIMITE_CONFIRMADOS: self._confirmados.popitem(last=False)
+
+    def _proximos(self):
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT rowid, id, dados, tentativas, grupo FROM fila WHERE proxima_tentativa <= ? ORDER BY rowid LIMIT ?",
+                (time.time(), self.tamanho_lote)
+            ).fetchall()
+            # Completa grupos cortados pelo LIMIT
+            grupos = {g for *_, g in linhas if g}
+            if grupos:
+                vistos = {l[1] for l in linhas}
+                marcas = ",".join("?" * len(grupos))
+                extras = self._conn.execute(
+                    f"SELECT rowid, id, dados, tentativas, grupo FROM fila WHERE grupo IN ({marcas})", tuple(grupos)
+                ).fetchall()
+                linhas = sorted(linhas + [l for l in extras if l[1] not in vistos])
+        return [(i, json.loads(d), t, g) for _, i, d, t, g in linhas]
+
+    def _remover(self, ids):
+        if not ids: return
+        with self._lock:
+            self._conn.executemany("DELETE FROM fila WHERE id = ?", [(i,) for i in ids])
+
+    def _adiar(self, itens):
+        with self._lock:
+            for i, _, t, _ in itens:
+                espera = min(self.backoff_max, 2 ** t)
+                self._conn.execute("UPDATE fila SET tentativas = ?, proxima_tentativa = ? WHERE id = ?", (t + 1, time.time() + espera, i))
+
+    def descarregar(self):
+        # Envia um lote; retorna quantos itens foram confirmados
+        itens = self._proximos()
+        if not itens: return 0
+        try:
+            confirmados = self.enviar([(i, d, g) for i, d, _, g in itens])
+        except Exception as e:
+            self.ultimo_erro = str(e)
+            self._adiar(itens)
+            return 0
+        self.ultimo_erro = None
+        self._confirmar(confirmados or [])
+        self._remover([i for i, _, _, _ in itens])
+        return len(itens)
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try: enviados = self.descarregar()
+            except Exception: enviados = 0
+            if not enviados:
+                self._evento.wait(self.intervalo if self.tamanho() else None)
+                self._evento.clear()
+
+    def iniciar(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="fila_local", daemon=True)
+            self._thread.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        self._evento.set()
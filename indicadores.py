@@ -0,0 +1,225 @@
+import time
+import weakref
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+from google.cloud import firestore
+
+# --- INDICADORES (ROLLUPS) ---
+# Agregados mantidos na escrita em 'indicadores_producao':
+#   total          -> acumulado geral
+#   dia_AAAAMMDD   -> por dia (campo 'data' para consultas por período), com mapa por SAP
+#   sap_<código>   -> acumulado por código SAP
+# Cada documento guarda registros, qtd, peso_real, peso_teorico, sucata e pendentes.
+# Durante uma reconstrução, 'total' leva a marca 'reconstrucao_expira_em' (renovada
+# a cada página lida): gravações que mexem nos agregados (salvar, arquivar, excluir)
+# são recusadas até ela sair, e a fila local do operador reenvia depois.
+# 'total' também guarda 'reconstruido_em': sem ele (base que já tinha registros
+# quando os agregados entraram, ou reconstrução interrompida) os agregados não
+# valem, e a inicialização do app reconstrói uma vez em segundo plano
+# (reconstruir_se_necessario). Na implantação, rodar antes `python indicadores.py`
+# evita essa janela com gravações retidas na fila local.
+
+COLECAO = 'indicadores_producao'
+COLECAO_ORIGEM = 'perfis_producao'
+CAMPOS = ['registros', 'qtd', 'peso_real', 'peso_teorico', 'sucata', 'pendentes']
+CAMPOS_INTEIROS = {'registros', 'qtd', 'pendentes'}
+VALIDADE_MARCA = timedelta(minutes=5)
+CACHE_MARCA_S = 5
+ESPERA_GRAVADORES_S = 2 * CACHE_MARCA_S
+ERRO_RECONSTRUINDO = "Indicadores em reconstrução; tente novamente em alguns minutos."
+
+_marcas_lidas = weakref.WeakKeyDictionary()
+_lock_marcas = threading.Lock()
+
+def _dia(ts):
+    return ts.strftime('%Y%m%d')
+
+def _valores(reg, sinal=1):
+    pendente = 1 if reg.get('status_reserva') == 'Pendente' else 0
+    return {
+        'registros': sinal,
+        'qtd': sinal * int(reg.get('qtd', 0) or 0),
+        'peso_real': sinal * float(reg.get('peso_real', 0) or 0),
+        'peso_teorico': sinal * float(reg.get('peso_teorico', 0) or 0),
+        'sucata': sinal * float(reg.get('sucata', 0) or 0),
+        'pendentes': sinal * pendente
+    }
+
+def _incrementos(valores):
+    return {k: firestore.Increment(int(v) if k in CAMPOS_INTEIROS else float(v)) for k, v in valores.items() if v}
+
+def _escritas(db, chaves):
+    # chaves: {(dia, sap): valores} -> lista de (ref, dados com Increment) agregada por documento
+    col = db.collection(COLECAO)
+    total, dias, saps = defaultdict(float), defaultdict(lambda: defaultdict(float)), defaultdict(lambda: defaultdict(float))
+    por_dia_sap = defaultdict(lambda: defaultdict(float))
+    for (dia, sap), valores in chaves.items():
+        for k, v in valores.items():
+            total[k] += v
+            dias[dia][k] += v
+            saps[sap][k] += v
+            por_dia_sap[(dia, sap)][k] += v
+
+    escritas = [(col.document('total'), _incrementos(total))]
+    for dia, valores in dias.items():
+        dados = _incrementos(valores) | {'tipo': 'dia', 'data': f"{dia[:4]}-{dia[4:6]}-{dia[6:]}"}
+        dados['por_sap'] = {sap: _incrementos(v) for (d, sap), v in por_dia_sap.items() if d == dia}
+        escritas.append((col.document(f"dia_{dia}"), dados))
+    for sap, valores in saps.items():
+        escritas.append((col.document(f"sap_{sap}"), _incrementos(valores) | {'tipo': 'sap', 'cod_sap': sap}))
+    return escritas
+
+def _aplicar(batch, db, regs, sinal=1, so_pendentes=False):
+    chaves = defaultdict(lambda: defaultdict(float))
+    for reg in regs:
+        valores = _valores(reg, sinal)
+        if so_pendentes: valores = {'pendentes': valores['pendentes']}
+        acc = chaves[(_dia(reg['timestamp']), str(reg.get('cod_sap', '')))]
+        for k, v in valores.items(): acc[k] += v
+    for ref, dados in _escritas(db, chaves):
+        batch.set(ref, dados, merge=True)
+
+def registrar(batch, db, payloads):
+    # Chamado dentro do mesmo batch que grava os registros de produção
+    _aplicar(batch, db, payloads)
+
+def registrar_arquivamento(batch, db, regs):
+    # Chamado no mesmo batch que muda o status; regs como lidos antes da mudança
+    # (apenas o contador de pendentes muda, e só para quem estava 'Pendente')
+    regs = [r for r in regs if r.get('status_reserva') == 'Pendente']
+    if regs: _aplicar(batch, db, regs, sinal=-1, so_pendentes=True)
+
+def estornar(db, regs):
+    # Registros removidos fora do Firestore (ex.: camada fria)
+    if not regs: return
+    batch = db.batch()
+    _aplicar(batch, db, regs, sinal=-1)
+    batch.commit()
+
+def excluir_registro(db, ref):
+    # Exclusão + estorno dos agregados na mesma transação
+    @firestore.transactional
+    def txn(transaction):
+        snap = ref.get(transaction=transaction)
+        if not snap.exists: return False
+        reg = snap.to_dict()
+        if reg.get('timestamp') is not None: _aplicar(transaction, db, [reg], sinal=-1)
+        transaction.delete(ref)
+        return True
+    return txn(db.transaction())
+
+def ref_total(db):
+    return db.collection(COLECAO).document('total')
+
+def em_reconstrucao(dados):
+    expira_em = (dados or {}).get('reconstrucao_expira_em')
+    return expira_em is not None and expira_em > datetime.now(timezone.utc)
+
+def verificar_gravacao(db):
+    # Chamado antes de gravações que mexem nos agregados; a marca é relida a cada
+    # CACHE_MARCA_S (a reconstrução espera ESPERA_GRAVADORES_S antes de começar a ler)
+    agora = time.monotonic()
+    with _lock_marcas:
+        lida_em, ocupado = _marcas_lidas.get(db, (None, False))
+    if lida_em is None or agora - lida_em > CACHE_MARCA_S:
+        snap = ref_total(db).get()
+        ocupado = snap.exists and em_reconstrucao(snap.to_dict())
+        with _lock_marcas: _marcas_lidas[db] = (agora, ocupado)
+    if ocupado: raise RuntimeError(ERRO_RECONSTRUINDO)
+
+def _marcar_reconstrucao(db):
+    # Uma reconstrução por vez (entre processos); retorna False se já houver outra
+    ref = ref_total(db)
+
+    @firestore.transactional
+    def txn(transaction):
+        snap = ref.get(transaction=transaction)
+        if snap.exists and em_reconstrucao(snap.to_dict()): return False
+        transaction.set(ref, {'reconstrucao_expira_em': datetime.now(timezone.utc) + VALIDADE_MARCA}, merge=True)
+        return True
+
+    return txn(db.transaction())
+
+def limpar(db):
+    # Após o expurgo: base vazia, agregados zerados já valem (sem nova reconstrução)
+    docs = list(db.collection(COLECAO).stream())
+    for i in range(0, len(docs), 450):
+        batch = db.batch()
+        for d in docs[i:i + 450]: batch.delete(d.reference)
+        batch.commit()
+    ref_total(db).set({'reconstruido_em': firestore.SERVER_TIMESTAMP})
+
+def ler_total(db):
+    snap = db.collection(COLECAO).document('total').get()
+    dados = snap.to_dict() if snap.exists else {}
+    return {k: dados.get(k, 0) for k in CAMPOS}
+
+def ler_periodo(db, data_inicio, data_fim):
+    # Soma os documentos diários do período (um documento por dia)
+    docs = db.collection(COLECAO)\
+            .where('data', '>=', data_inicio.strftime('%Y-%m-%d'))\
+            .where('data', '<=', data_fim.strftime('%Y-%m-%d'))\
+            .stream()
+    soma = {k: 0 for k in CAMPOS}
+    for d in docs:
+        dados = d.to_dict()
+        for k in CAMPOS: soma[k] += dados.get(k, 0)
+    return soma
+
+def reconstruir(db, progresso=None, extras=(), espera_s=None):
+    # Reconciliação: recalcula todos os agregados a partir dos registros brutos
+    # (Firestore + registros de fora dele, como a camada fria). Sob a marca de
+    # reconstrução, nenhuma gravação altera os agregados entre a leitura e a escrita.
+    # Os documentos são sobrescritos (sem apagar antes: o painel nunca mostra zeros);
+    # 'total' vai por último e leva 'reconstruido_em', o que também retira a marca.
+    if not _marcar_reconstrucao(db): raise RuntimeError(ERRO_RECONSTRUINDO)
+    ref = ref_total(db)
+    try:
+        time.sleep(ESPERA_GRAVADORES_S if espera_s is None else espera_s)
+        chaves = defaultdict(lambda: defaultdict(float))
+        lidos = 0
+        for reg in chain((d.to_dict() for d in db.collection(COLECAO_ORIGEM).stream()), extras):
+            lidos += 1
+            if lidos % 500 == 0:
+                ref.set({'reconstrucao_expira_em': datetime.now(timezone.utc) + VALIDADE_MARCA}, merge=True)
+                if progresso: progresso(lidos)
+            if reg.get('timestamp') is None: continue
+            acc = chaves[(_dia(reg['timestamp']), str(reg.get('cod_sap', '')))]
+            for k, v in _valores(reg).items(): acc[k] += v
+
+        total, *escritas = _escritas(db, chaves)
+        novos = {r.id for r, _ in escritas}
+        obsoletos = [d.reference for d in db.collection(COLECAO).stream() if d.id != 'total' and d.id not in novos]
+        for i in range(0, len(obsoletos), 450):
+            batch = db.batch()
+            for r in obsoletos[i:i + 450]: batch.delete(r)
+            batch.commit()
+        for i in range(0, len(escritas), 450):
+            batch = db.batch()
+            for r, dados in escritas[i:i + 450]: batch.set(r, dados)
+            batch.commit()
+        ref.set(total[1] | {'reconstruido_em': firestore.SERVER_TIMESTAMP})
+    except BaseException:
+        # Agregados possivelmente pela metade: sem 'reconstruido_em' a próxima
+        # inicialização do app reconstrói de novo
+        ref.set({'reconstrucao_expira_em': firestore.DELETE_FIELD, 'reconstruido_em': firestore.DELETE_FIELD}, merge=True)
+        raise
+    return lidos
+
+def reconstruir_se_necessario(db, extras=()):
+    # Reconstrução única na inicialização; None se os agregados já valem ou se
+    # outro processo já está reconstruindo
+    snap = ref_total(db).get()
+    dados = snap.to_dict() if snap.exists else {}
+    if dados.get('reconstruido_em') is not None or em_reconstrucao(dados): return None
+    try: return reconstruir(db, extras=extras)
+    except RuntimeError: return None
+
+if __name__ == "__main__":
+    # Uso: GOOGLE_APPLICATION_CREDENTIALS=chave.json python indicadores.py
+    # Rodar uma vez na implantação (base com registros anteriores aos agregados)
+    # e sempre que os agregados divergirem dos registros.
+    import arquivo_frio
+    print(f"Registros processados: {reconstruir(firestore.Client(), extras=arquivo_frio.ArquivoFrio().registros())}")
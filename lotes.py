@@ -0,0 +1,180 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+
+import metricas
+
+# --- ALOCAÇÃO DE LOTES (RESERVA EM BLOCOS) ---
+# O contador 'controles/lotes_perfis' guarda o último número RESERVADO por SAP.
+# Cada processo reserva um bloco via transação e registra a reserva em
+# 'reservas_lotes'; cada gravação atualiza 'usado_ate' no mesmo commit do registro,
+# então números não usados podem ser devolvidos (ou pulados) mesmo após queda.
+
+COL_CONTROLES = 'controles'
+DOC_CONTADOR = 'lotes_perfis'
+COL_RESERVAS = 'reservas_lotes'
+
+def formatar_lote(n):
+    return f"BRASA{int(n):05d}"
+
+def ref_contador(db):
+    return db.collection(COL_CONTROLES).document(DOC_CONTADOR)
+
+def encerrar_reserva(db, ref_reserva):
+    # Devolve a sobra ao contador se ninguém reservou depois; senão os números são pulados
+    ref_cont = ref_contador(db)
+
+    @firestore.transactional
+    def txn(transaction):
+        snap_res = ref_reserva.get(transaction=transaction)
+        if not snap_res.exists: return False
+        res = snap_res.to_dict()
+        snap_cont = ref_cont.get(transaction=transaction)
+        sap_str = str(res['cod_sap'])
+        atual = int((snap_cont.to_dict() or {}).get(sap_str, 0)) if snap_cont.exists else 0
+        devolvido = atual == int(res['fim'])
+        if devolvido:
+            transaction.set(ref_cont, {sap_str: int(res['usado_ate'])}, merge=True)
+        transaction.delete(ref_reserva)
+        return devolvido
+
+    return txn(db.transaction())
+
+def ajustar_contador(db, cod_sap, valor):
+    # Ajuste manual e fim das reservas abertas do SAP na mesma transação: uma reserva
+    # antiga não pode mais devolver sobra por cima do novo valor, e processos com bloco
+    # em memória falham ao confirmar (reserva apagada) e reservam de novo
+    sap_str = str(cod_sap)
+    ref_cont = ref_contador(db)
+    consulta = db.collection(COL_RESERVAS).where('cod_sap', '==', sap_str)
+
+    @firestore.transactional
+    def txn(transaction):
+        reservas = list(consulta.stream(transaction=transaction))
+        transaction.set(ref_cont, {sap_str: int(valor)}, merge=True)
+        for r in reservas: transaction.delete(r.reference)
+        return len(reservas)
+
+    return txn(db.transaction())
+
+def recuperar_reservas_expiradas(db, margem_min=5):
+    # Reservas órfãs (processo caiu) são encerradas após a validade + margem
+    limite = datetime.now(timezone.utc) - timedelta(minutes=margem_min)
+    docs = db.collection(COL_RESERVAS).where('expira_em', '<', limite).stream()
+    total = 0
+    for d in docs:
+        try:
+            encerrar_reserva(db, d.reference)
+            total += 1
+        except Exception: pass
+    return total
+
+class AlocadorLotes:
+    def __init__(self, db, tamanho_bloco=20, validade_min=60):
+        self.db = db
+        self.tamanho_bloco = int(tamanho_bloco)
+        self.validade = timedelta(minutes=validade_min)
+        self._lock = threading.Lock()
+        self._blocos = {}
+
+    @metricas.medir('firestore.reservar_lotes')
+    def _reservar(self, sap_str, n=None):
+        ref_cont = ref_contador(self.db)
+        ref_res = self.db.collection(COL_RESERVAS).document()
+        expira_em = datetime.now(timezone.utc) + self.validade
+        n = n or self.tamanho_bloco
+
+        @firestore.transactional
+        def txn(transaction):
+            snap = ref_cont.get(transaction=transaction)
+            ultimo = int((snap.to_dict() or {}).get(sap_str, 0)) if snap.exists else 0
+            transaction.set(ref_cont, {sap_str: ultimo + n}, merge=True)
+            transaction.set(ref_res, {
+                'cod_sap': sap_str,
+                'inicio': ultimo + 1,
+                'fim': ultimo + n,
+                'usado_ate': ultimo,
+                'expira_em': expira_em
+            })
+            return ultimo + 1
+
+        inicio = txn(self.db.transaction())
+        return {'ref': ref_res, 'proximo': inicio, 'fim': inicio + n - 1, 'expira_em': expira_em}
+
+    def alocar(self, cod_sap):
+        # Retorna (numero, ref_reserva); só acessa o banco quando o bloco acaba ou expira
+        sap_str = str(cod_sap)
+        with self._lock:
+            bloco = self._blocos.get(sap_str)
+            if bloco is None or bloco['proximo'] > bloco['fim'] or datetime.now(timezone.utc) >= bloco['expira_em']:
+                if bloco is not None: self.recuperar_em_segundo_plano()
+                bloco = self._reservar(sap_str)
+                self._blocos[sap_str] = bloco
+            numero = bloco['proximo']
+            bloco['proximo'] += 1
+            return numero, bloco['ref']
+
+    @metricas.medir('firestore.reservar_lotes')
+    def _estender(self, sap_str, bloco, extra):
+        # Aumenta a própria reserva, só se ninguém reservou depois dela
+        ref_cont = ref_contador(self.db)
+        ref_res = bloco['ref']
+        expira_em = datetime.now(timezone.utc) + self.validade
+
+        @firestore.transactional
+        def txn(transaction):
+            snap = ref_cont.get(transaction=transaction)
+            ultimo = int((snap.to_dict() or {}).get(sap_str, 0)) if snap.exists else 0
+            if ultimo != bloco['fim'] or not ref_res.get(transaction=transaction).exists: return False
+            transaction.set(ref_cont, {sap_str: ultimo + extra}, merge=True)
+            transaction.update(ref_res, {'fim': ultimo + extra, 'expira_em': expira_em})
+            return True
+
+        if not txn(self.db.transaction()): return False
+        bloco['fim'] += extra
+        bloco['expira_em'] = expira_em
+        return True
+
+    def alocar_faixa(self, cod_sap, n):
+        # n números contíguos (entrada em lote), tirados da mesma reserva usada por alocar().
+        # Se o bloco não comporta, ele é estendido; se outro processo reservou depois,
+        # um bloco novo é reservado e a sobra do anterior é pulada.
+        sap_str = str(cod_sap)
+        with self._lock:
+            bloco = self._blocos.get(sap_str)
+            valido = bloco is not None and datetime.now(timezone.utc) < bloco['expira_em']
+            restante = bloco['fim'] - bloco['proximo'] + 1 if valido else 0
+            if valido and restante < n:
+                valido = self._estender(sap_str, bloco, n - restante + self.tamanho_bloco)
+            if not valido:
+                if bloco is not None: self.recuperar_em_segundo_plano()
+                bloco = self._reservar(sap_str, n + self.tamanho_bloco)
+                self._blocos[sap_str] = bloco
+            inicio = bloco['proximo']
+            bloco['proximo'] += n
+            return inicio, bloco['ref']
+
+    def confirmar(self, batch, ref_reserva, numero):
+        # Registra o uso do número no mesmo commit do documento de produção
+        batch.update(ref_reserva, {'usado_ate': firestore.Maximum(int(numero))})
+
+    def descartar(self, cod_sap=None):
+        # Abandona o bloco local (falha de gravação ou ajuste manual do contador)
+        with self._lock:
+            if cod_sap is None: self._blocos.clear()
+            else: self._blocos.pop(str(cod_sap), None)
+
+    def devolver(self):
+        with self._lock:
+            blocos = list(self._blocos.values())
+            self._blocos.clear()
+        for b in blocos:
+            try: encerrar_reserva(self.db, b['ref'])
+            except Exception: pass
+
+    def recuperar_em_segundo_plano(self):
+        # Blocos substituídos só são encerrados após expirar, pois pode haver gravação em andamento
+        def tarefa():
+            try: recuperar_reservas_expiradas(self.db)
+            except Exception: pass
+        threading.Thread(target=tarefa, daemon=True).start()
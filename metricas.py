@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# --- MÉTRICAS DE DESEMPENHO ---
+# Cronômetros leves em volta dos caminhos críticos (Firestore, catálogo, DataFrame,
+# Excel, reruns). As últimas amostras de cada operação ficam num buffer circular
+# em memória do processo. Opcionalmente cada amostra é anexada a um JSONL
+# (METRICAS_JSONL) e um resumo é regravado num arquivo texto do Prometheus
+# (METRICAS_PROM), no formato do textfile collector do node_exporter.
+
+CAPACIDADE = 2000
+INTERVALO_PROM = 15
+
+_lock = threading.Lock()
+# Só para o JSONL: a escrita em disco não bloqueia registrar() nem resumo()
+_lock_jsonl = threading.Lock()
+_operacoes = {}
+_prom_gravado_em = 0.0
+
+class _Operacao:
+    def __init__(self):
+        self.amostras = deque(maxlen=CAPACIDADE)
+        self.contagem = 0
+        self.erros = 0
+        self.soma = 0.0
+        self.ultima = None
+
+def percentil(valores, p):
+    if not valores: return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100.0 * (len(ordenados) - 1))))]
+
+def registrar(operacao, duracao, erro=False):
+    agora = time.time()
+    with _lock:
+        op = _operacoes.get(operacao)
+        if op is None: op = _operacoes[operacao] = _Operacao()
+        op.amostras.append(duracao)
+        op.contagem += 1
+        op.soma += duracao
+        op.ultima = agora
+        if erro: op.erros += 1
+    _gravar_jsonl(operacao, duracao, erro, agora)
+    _gravar_prometheus_periodico(agora)
+
+@contextmanager
+def cronometro(operacao):
+    # Só Exception conta como erro: st.rerun/st.stop não são falhas
+    inicio = time.perf_counter()
+    erro = False
+    try:
+        yield
+    except Exception:
+        erro = True
+        raise
+    finally:
+        registrar(operacao, time.perf_counter() - inicio, erro)
+
+def medir(operacao):
+    def decorador(fn):
+        @functools.wraps(fn)
+        def envolvida(*args, **kwargs):
+            with cronometro(operacao):
+                return fn(*args, **kwargs)
+        return envolvida
+    return decorador
+
+def resumo():
+    with _lock:
+        copia = {nome: (list(op.amostras), op.contagem, op.erros, op.soma, op.ultima) for nome, op in _operacoes.items()}
+    linhas = []
+    for nome, (amostras, contagem, erros, soma, ultima) in sorted(copia.items()):
+        linhas.append({
+            'operacao': nome,
+            'contagem': contagem,
+            'erros': erros,
+            'media_ms': soma / contagem * 1000 if contagem else 0.0,
+            'p50_ms': percentil(amostras, 50) * 1000,
+            'p95_ms': percentil(amostras, 95) * 1000,
+            'p99_ms': percentil(amostras, 99) * 1000,
+            'max_ms': max(amostras) * 1000 if amostras else 0.0,
+            'ultima': ultima
+        })
+    return linhas
+
+def limpar():
+    with _lock:
+        _operacoes.clear()
+
+# --- SAÍDAS OPCIONAIS ---
+def _gravar_jsonl(operacao, duracao, erro, quando):
+    caminho = os.environ.get('METRICAS_JSONL')
+    if not caminho: return
+    linha = json.dumps({'ts': quando, 'operacao': operacao, 'ms': round(duracao * 1000, 3), 'erro': erro})
+    try:
+        with _lock_jsonl:
+            with open(caminho, 'a', encoding='utf-8') as f: f.write(linha + "\n")
+    except OSError: pass
+
+def texto_prometheus():
+    saida = [
+        "# HELP apoio_operacao_segundos Duração das operações instrumentadas.",
+        "# TYPE apoio_operacao_segundos summary"
+    ]
+    erros = [
+        "# HELP apoio_operacao_erros_total Operações que terminaram em exceção.",
+        "# TYPE apoio_operacao_erros_total counter"
+    ]
+    for r in resumo():
+        rotulo = r['operacao'].replace('\\', '\\\\').replace('"', '\\"')
+        for q in (50, 95, 99):
+            saida.append(f'apoio_operacao_segundos{{operacao="{rotulo}",quantile="{q / 100}"}} {r[f"p{q}_ms"] / 1000:.6f}')
+        saida.append(f'apoio_operacao_segundos_sum{{operacao="{rotulo}"}} {r["media_ms"] * r["contagem"] / 1000:.6f}')
+        saida.append(f'apoio_operacao_segundos_count{{operacao="{rotulo}"}} {r["contagem"]}')
+        erros.append(f'apoio_operacao_erros_total{{operacao="{rotulo}"}} {r["erros"]}')
+    return "\n".join(saida + erros) + "\n"
+
+def gravar_prometheus(caminho=None):
+    # Escrita atômica: o coletor nunca lê um arquivo pela metade
+    caminho = caminho or os.environ.get('METRICAS_PROM')
+    if not caminho: return None
+    tmp = f"{caminho}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f: f.write(texto_prometheus())
+        os.replace(tmp, caminho)
+    except OSError:
+        try: os.remove(tmp)
+        except OSError: pass
+        return None
+    return caminho
+
+def _gravar_prometheus_periodico(agora):
+    global _prom_gravado_em
+    if not os.environ.get('METRICAS_PROM') or agora - _prom_gravado_em < INTERVALO_PROM: return
+    _prom_gravado_em = agora
+    gravar_prometheus()
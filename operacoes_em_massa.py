@@ -0,0 +1,107 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from google.api_core import exceptions
+
+# --- OPERAÇÕES EM MASSA ---
+# Escritas agrupadas em batches (limite do Firestore: 500 operações por commit),
+# com nova tentativa e backoff por batch. Se um batch continuar falhando, as
+# operações dele são repetidas uma a uma para isolar os documentos problemáticos.
+
+TAMANHO_BATCH = 450
+# Repetir o mesmo batch não resolve: vai direto para o isolamento um a um
+ERROS_DEFINITIVOS = (exceptions.FailedPrecondition, exceptions.NotFound)
+
+def _fatiar(itens, tamanho):
+    for i in range(0, len(itens), tamanho):
+        yield itens[i:i + tamanho]
+
+def _commit_com_retry(db, refs, aplicar, tentativas, finalizar=None):
+    for t in range(tentativas):
+        try:
+            batch = db.batch()
+            for ref in refs: aplicar(batch, ref)
+            if finalizar: finalizar(batch, refs)
+            batch.commit()
+            return list(refs), []
+        except ERROS_DEFINITIVOS:
+            break
+        except Exception:
+            if t < tentativas - 1: time.sleep(0.5 * (2 ** t))
+
+    ok, falhas = [], []
+    for ref in refs:
+        try:
+            batch = db.batch()
+            aplicar(batch, ref)
+            if finalizar: finalizar(batch, [ref])
+            batch.commit()
+            ok.append(ref)
+        except Exception:
+            falhas.append(ref)
+    return ok, falhas
+
+def executar_em_lotes(db, refs, aplicar, tamanho=TAMANHO_BATCH, workers=4, tentativas=3, progresso=None, finalizar=None):
+    # aplicar(batch, ref) registra a operação; finalizar(batch, refs) acrescenta escritas que
+    # valem para o batch inteiro (ex.: agregados), no mesmo commit; progresso(feitos, total)
+    # é chamado na thread atual
+    refs = list(refs)
+    total = len(refs)
+    ok, falhas = [], []
+    if not refs: return ok, falhas
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futuros = [pool.submit(_commit_com_retry, db, fatia, aplicar, tentativas, finalizar) for fatia in _fatiar(refs, tamanho)]
+        for f in as_completed(futuros):
+            o, e = f.result()
+            ok.extend(o)
+            falhas.extend(e)
+            if progresso: progresso(len(ok) + len(falhas), total)
+    return ok, falhas
+
+def atualizar_status(db, colecao, ids, campos, progresso=None, versoes=None, **kw):
+    # versoes: {id: update_time lido}; com versão, a atualização só vale se o documento
+    # não mudou desde a leitura (senão o batch falha e o id acaba em ids_falha).
+    # Retorna (ids_ok, ids_falha)
+    col = db.collection(colecao)
+    refs = [col.document(i) for i in ids]
+    versoes = versoes or {}
+
+    def aplicar(batch, ref):
+        versao = versoes.get(ref.id)
+        if versao is None: batch.update(ref, campos)
+        else: batch.update(ref, campos, option=db.write_option(last_update_time=versao))
+
+    ok, falhas = executar_em_lotes(db, refs, aplicar, progresso=progresso, **kw)
+    return [r.id for r in ok], [r.id for r in falhas]
+
+def expurgar_colecao(db, colecao, tamanho=TAMANHO_BATCH, workers=8, tentativas=3, progresso=None):
+    # Páginas só com as chaves (projeção em __name__) por cursor; cada página vira
+    # um batch de exclusão enviado ao pool. Interrompido, basta rodar de novo:
+    # o que já foi apagado não aparece mais na consulta.
+    consulta = db.collection(colecao).select(['__name__']).order_by('__name__')
+    apagar = lambda b, r: b.delete(r)
+    apagados, falhas = 0, []
+    em_voo = set()
+    ultimo = None
+
+    def coletar(futuros):
+        nonlocal apagados
+        for f in futuros:
+            o, e = f.result()
+            apagados += len(o)
+            falhas.extend(e)
+        if progresso: progresso(apagados)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            q = consulta.start_after(ultimo) if ultimo is not None else consulta
+            pagina = list(q.limit(tamanho).stream())
+            if not pagina: break
+            ultimo = pagina[-1]
+            em_voo.add(pool.submit(_commit_com_retry, db, [d.reference for d in pagina], apagar, tentativas))
+            if len(em_voo) >= workers * 2:
+                feitos, em_voo = wait(em_voo, return_when=FIRST_COMPLETED)
+                coletar(feitos)
+            if len(pagina) < tamanho: break
+        coletar(as_completed(em_voo))
+    return apagados, [r.id for r in falhas]
@@ -0,0 +1,506 @@
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+
+import lotes
+import indicadores
+import exportacao
+import operacoes_em_massa
+import metricas
+import arquivo_frio
+
+# --- REPOSITÓRIO DE PRODUÇÃO ---
+# Todo acesso a dados do app passa por aqui. RepositorioFirestore é o backend
+# de produção; RepositorioMemoria guarda tudo em dicionários (com latência
+# opcional por ida ao servidor) para testes offline e benchmarks.
+# Lotes lançados antigos podem ser compactados para a camada fria (arquivo_frio);
+# periodo() e excluir() consultam as duas camadas. Os indicadores não mudam na
+# compactação: os registros continuam existindo, só mudam de lugar.
+
+COLECAO = 'perfis_producao'
+STATUS_PENDENTE = 'Pendente'
+STATUS_ARQUIVADO = 'Ok - Lançada'
+TAMANHO_PAGINA_PENDENTES = 100
+# Cada batch de arquivamento leva também os agregados (total + 1 por dia + 1 por SAP):
+# 150 registros ficam abaixo das 500 escritas por commit mesmo no pior caso
+TAMANHO_BATCH_ARQUIVAR = 150
+
+class Repositorio(ABC):
+    # itens: [(id, payload, grupo)], com payload['timestamp'] em ISO; retorna [(id, lote)]
+    # na ordem dos itens, incluindo itens que já estavam gravados (reenvio).
+    # Itens do mesmo SAP num mesmo grupo (entrada em lote) recebem números contíguos.
+    @abstractmethod
+    def salvar(self, itens): raise NotImplementedError
+    @abstractmethod
+    def pendentes(self): raise NotImplementedError
+    # Uma página de pendentes (timestamp decrescente) e o cursor opaco da próxima (None no fim)
+    @abstractmethod
+    def pendentes_pagina(self, tamanho=TAMANHO_PAGINA_PENDENTES, apos=None): raise NotImplementedError
+    @abstractmethod
+    def contar_pendentes(self): raise NotImplementedError
+    # Gera páginas (listas de dicts) em ordem decrescente de timestamp; o período é
+    # buscado em fatias de `dias_fatia` dias, até `workers` em paralelo
+    @abstractmethod
+    def periodo(self, inicio, fim, tamanho_pagina=exportacao.TAMANHO_PAGINA, workers=exportacao.WORKERS_FATIAS, dias_fatia=exportacao.DIAS_FATIA): raise NotImplementedError
+    # registros: dicts com 'id_doc'; retorna (ids_ok, ids_falha)
+    @abstractmethod
+    def arquivar(self, registros, progresso=None): raise NotImplementedError
+    @abstractmethod
+    def excluir(self, id_doc): raise NotImplementedError
+    @abstractmethod
+    def contadores(self): raise NotImplementedError
+    @abstractmethod
+    def ajustar_contador(self, cod_sap, valor): raise NotImplementedError
+    @abstractmethod
+    def indicadores_total(self): raise NotImplementedError
+    @abstractmethod
+    def indicadores_periodo(self, data_inicio, data_fim): raise NotImplementedError
+    @abstractmethod
+    def reconstruir_indicadores(self): raise NotImplementedError
+    @abstractmethod
+    def expurgo_pendente(self): raise NotImplementedError
+    # Retorna (apagados, ids_falha); contadores só são zerados sem falhas
+    @abstractmethod
+    def expurgar(self, progresso=None): raise NotImplementedError
+    # Move lotes lançados com mais de `dias` para a camada fria; retorna (movidos, ids_falha)
+    @abstractmethod
+    def compactar(self, dias=arquivo_frio.DIAS_QUENTE, progresso=None): raise NotImplementedError
+    # Partições da camada fria: [{'mes', 'registros', 'peso_real', 'bytes'}]
+    @abstractmethod
+    def resumo_frio(self): raise NotImplementedError
+    # Sem pasta definida (ARQUIVO_FRIO_DIR) compactar() é recusado
+    @abstractmethod
+    def frio_configurado(self): raise NotImplementedError
+
+# --- FIRESTORE ---
+class RepositorioFirestore(Repositorio):
+    def __init__(self, db, alocador, frio=None):
+        self.db = db
+        self.alocador = alocador
+        self.frio = frio or arquivo_frio.ArquivoFrio()
+        self.col = db.collection(COLECAO)
+
+    def _dicts(self, docs):
+        return [d.to_dict() | {'id_doc': d.id, 'atualizado_em': d.update_time} for d in docs]
+
+    def _payload(self, dados, numero):
+        return dados | {
+            "timestamp": datetime.fromisoformat(dados['timestamp']),
+            "gravado_em": firestore.SERVER_TIMESTAMP,
+            "lote": lotes.formatar_lote(numero)
+        }
+
+    def _salvar_reservas(self, itens):
+        # Um único commit com registros, consumo das reservas e indicadores
+        faixas = Counter((g, str(d['cod_sap'])) for _, d, g in itens if g)
+        proximos = {}
+        batch = self.db.batch()
+        payloads, usados = [], {}
+        for id_item, dados, grupo in itens:
+            chave = (grupo, str(dados['cod_sap']))
+            if faixas.get(chave, 0) > 1:
+                if chave not in proximos: proximos[chave] = list(self.alocador.alocar_faixa(dados['cod_sap'], faixas[chave]))
+                numero, ref_reserva = proximos[chave]
+                proximos[chave][0] += 1
+            else:
+                numero, ref_reserva = self.alocador.alocar(dados['cod_sap'])
+            payload = self._payload(dados, numero)
+            batch.create(self.col.document(id_item), payload)
+            payloads.append(payload)
+            usados[ref_reserva.path] = (ref_reserva, max(numero, usados.get(ref_reserva.path, (None, 0))[1]))
+
+        for ref_reserva, numero in usados.values():
+            self.alocador.confirmar(batch, ref_reserva, numero)
+        indicadores.registrar(batch, self.db, payloads)
+        batch.commit()
+        return [(i, p['lote']) for (i, _, _), p in zip(itens, payloads)]
+
+    @metricas.medir('firestore.salvar')
+    def salvar(self, itens):
+        # Durante a reconstrução dos indicadores a gravação é recusada (a fila reenvia)
+        indicadores.verificar_gravacao(self.db)
+        refs = [self.col.document(i) for i, _, _ in itens]
+        try:
+            return self._salvar_reservas(itens)
+        except Exception:
+            for _, dados, _ in itens: self.alocador.descartar(dados['cod_sap'])
+            # Reenvio após perda de confirmação: itens já gravados saem do lote
+            existentes = {s.id: s.get('lote') for s in self.db.get_all(refs) if s.exists} if refs else {}
+            if not existentes: raise
+            restantes = [(i, d, g) for i, d, g in itens if i not in existentes]
+            if restantes: existentes.update(self.salvar(restantes))
+            return [(i, existentes[i]) for i, _, _ in itens]
+
+    def _consulta_pendentes(self):
+        # Índice composto status_reserva ASC + timestamp DESC (firestore.indexes.json):
+        # leituras proporcionais à fila de pendentes, não ao histórico
+        return self.col.where('status_reserva', '==', STATUS_PENDENTE).order_by('timestamp', direction=firestore.Query.DESCENDING)
+
+    @metricas.medir('firestore.pendentes')
+    def pendentes(self):
+        regs = []
+        for pagina in exportacao.paginar_consulta(self._consulta_pendentes()): regs.extend(self._dicts(pagina))
+        return regs
+
+    @metricas.medir('firestore.pendentes_pagina')
+    def pendentes_pagina(self, tamanho=TAMANHO_PAGINA_PENDENTES, apos=None):
+        consulta = self._consulta_pendentes()
+        if apos is not None: consulta = consulta.start_after(apos)
+        docs = list(consulta.limit(tamanho).stream())
+        return self._dicts(docs), (docs[-1] if len(docs) == tamanho else None)
+
+    @metricas.medir('firestore.contar_pendentes')
+    def contar_pendentes(self):
+        return self.col.where('status_reserva', '==', STATUS_PENDENTE).count().get()[0][0].value
+
+    @metricas.medir('firestore.fatia')
+    def _fatia(self, a, b, tamanho_pagina):
+        consulta = self.col.where('timestamp', '>=', a)\
+                           .where('timestamp', '<', b)\
+                           .order_by('timestamp', direction=firestore.Query.DESCENDING)
+        return [r for pagina in exportacao.paginar_consulta(consulta, tamanho_pagina) for r in self._dicts(pagina)]
+
+    def periodo(self, inicio, fim, tamanho_pagina=exportacao.TAMANHO_PAGINA, workers=exportacao.WORKERS_FATIAS, dias_fatia=exportacao.DIAS_FATIA):
+        quentes = exportacao.buscar_em_fatias(lambda a, b: self._fatia(a, b, tamanho_pagina), inicio, fim, dias_fatia, workers)
+        yield from arquivo_frio.mesclar(quentes, self.frio.registros(inicio, fim, tamanho_pagina), tamanho=tamanho_pagina)
+
+    @metricas.medir('firestore.arquivar')
+    def arquivar(self, registros, progresso=None):
+        # Status e contador de pendentes no mesmo commit, com pré-condição na versão lida
+        # (atualizado_em): registro que mudou desde a leitura não desconta pendentes de novo
+        indicadores.verificar_gravacao(self.db)
+        por_id = {r['id_doc']: r for r in registros}
+        ok, falhas = operacoes_em_massa.atualizar_status(
+            self.db, COLECAO, list(por_id), {'status_reserva': STATUS_ARQUIVADO},
+            progresso=progresso, tamanho=TAMANHO_BATCH_ARQUIVAR,
+            versoes={i: r.get('atualizado_em') for i, r in por_id.items()},
+            finalizar=lambda batch, refs: indicadores.registrar_arquivamento(batch, self.db, [por_id[r.id] for r in refs])
+        )
+        if falhas:
+            # Já arquivados por outra tela (ou commit cuja resposta se perdeu) contam como feitos
+            snaps = self.db.get_all([self.col.document(i) for i in falhas])
+            feitos = {s.id for s in snaps if s.exists and s.get('status_reserva') == STATUS_ARQUIVADO}
+            ok += [i for i in falhas if i in feitos]
+            falhas = [i for i in falhas if i not in feitos]
+        return ok, falhas
+
+    def excluir(self, id_doc):
+        indicadores.verificar_gravacao(self.db)
+        if indicadores.excluir_registro(self.db, self.col.document(id_doc)): return True
+        removidos = self.frio.remover([id_doc])
+        indicadores.estornar(self.db, removidos)
+        return bool(removidos)
+
+    def contadores(self):
+        doc = lotes.ref_contador(self.db).get()
+        return doc.to_dict() if doc.exists else {}
+
+    def ajustar_contador(self, cod_sap, valor):
+        lotes.ajustar_contador(self.db, cod_sap, valor)
+        self.alocador.descartar(cod_sap)
+
+    @metricas.medir('firestore.indicadores')
+    def indicadores_total(self):
+        return indicadores.ler_total(self.db)
+
+    @metricas.medir('firestore.indicadores')
+    def indicadores_periodo(self, data_inicio, data_fim):
+        return indicadores.ler_periodo(self.db, data_inicio, data_fim)
+
+    def reconstruir_indicadores(self):
+        return indicadores.reconstruir(self.db, extras=self.frio.registros())
+
+    def preparar_indicadores_em_segundo_plano(self):
+        # Base em uso antes dos agregados: reconstrução única sem travar a inicialização
+        def tarefa():
+            try: indicadores.reconstruir_se_necessario(self.db, extras=self.frio.registros())
+            except Exception: pass
+        threading.Thread(target=tarefa, daemon=True).start()
+
+    def _ref_expurgo(self):
+        return self.db.collection(lotes.COL_CONTROLES).document('expurgo')
+
+    def expurgo_pendente(self):
+        return self._ref_expurgo().get().exists
+
+    def expurgar(self, progresso=None):
+        ref_expurgo = self._ref_expurgo()
+        ref_expurgo.set({'iniciado_em': datetime.now()})
+        total = self.col.count().get()[0][0].value
+        apagados, falhas = operacoes_em_massa.expurgar_colecao(
+            self.db, COLECAO, progresso=(lambda n: progresso(n, total)) if progresso else None
+        )
+        if not falhas:
+            operacoes_em_massa.expurgar_colecao(self.db, lotes.COL_RESERVAS)
+            self.frio.limpar()
+            indicadores.limpar(self.db)
+            lotes.ref_contador(self.db).delete()
+            ref_expurgo.delete()
+            self.alocador.descartar()
+        return apagados, falhas
+
+    @metricas.medir('firestore.compactar')
+    def compactar(self, dias=arquivo_frio.DIAS_QUENTE, progresso=None):
+        # Página gravada na camada fria antes de sair do Firestore; se a exclusão
+        # falhar, a cópia fria é desfeita para o registro ficar numa camada só.
+        # Índice composto status_reserva ASC + timestamp ASC (firestore.indexes.json)
+        if not self.frio.configurada(): raise RuntimeError(arquivo_frio.ERRO_SEM_PASTA)
+        corte = datetime.now(timezone.utc) - timedelta(days=dias)
+        consulta = self.col.where('status_reserva', '==', STATUS_ARQUIVADO)\
+                           .where('timestamp', '<', corte)\
+                           .order_by('timestamp')
+        movidos, falhas = 0, []
+        for pagina in exportacao.paginar_consulta(consulta, operacoes_em_massa.TAMANHO_BATCH):
+            self.frio.gravar(self._dicts(pagina))
+            ok, erro = operacoes_em_massa.executar_em_lotes(self.db, [d.reference for d in pagina], lambda b, r: b.delete(r))
+            if erro: self.frio.remover([r.id for r in erro])
+            movidos += len(ok)
+            falhas.extend(r.id for r in erro)
+            if progresso: progresso(movidos)
+        return movidos, falhas
+
+    def resumo_frio(self):
+        return self.frio.resumo()
+
+    def frio_configurado(self):
+        return self.frio.configurada()
+
+# --- MEMÓRIA ---
+# Mesmo custo em idas ao servidor do backend Firestore: números de lote saem de
+# blocos reservados (uma ida por reserva) e os indicadores são mantidos na escrita.
+class RepositorioMemoria(Repositorio):
+    def __init__(self, latencia_ms=0.0, frio=None, tamanho_bloco=20):
+        self.latencia = latencia_ms / 1000.0
+        self.frio = frio
+        self.tamanho_bloco = tamanho_bloco
+        self.idas = 0
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._contadores = {}
+        self._blocos = {}
+        self._total = dict.fromkeys(indicadores.CAMPOS, 0)
+        self._dias = {}
+        self._expurgando = False
+
+    def _ida(self, n=1):
+        # Simula n idas ao servidor
+        self.idas += n
+        if self.latencia: time.sleep(self.latencia * n)
+
+    def _copia(self, regs):
+        return [dict(r) for r in regs]
+
+    def semear(self, registros):
+        # Carga direta para benchmarks (sem latência); registros já com 'id_doc'
+        with self._lock:
+            for r in registros:
+                self._docs[r['id_doc']] = dict(r)
+                sap = str(r.get('cod_sap', ''))
+                n = int(str(r.get('lote', 'BRASA0'))[5:] or 0)
+                self._contadores[sap] = max(self._contadores.get(sap, 0), n)
+            self._blocos.clear()
+            self._acumular(registros)
+
+    def _acumular(self, regs, sinal=1, so_pendentes=False):
+        # Indicadores na escrita (total e por dia), como indicadores.registrar
+        for r in regs:
+            valores = indicadores._valores(r, sinal)
+            if so_pendentes: valores = {'pendentes': valores['pendentes']}
+            dia = self._dias.setdefault(r['timestamp'].date(), dict.fromkeys(indicadores.CAMPOS, 0))
+            for k, v in valores.items():
+                self._total[k] += v
+                dia[k] += v
+
+    def _alocar(self, sap, n=1):
+        # n números contíguos do bloco do SAP; bloco esgotado custa uma ida (reserva)
+        bloco = self._blocos.get(sap)
+        if bloco is None or bloco[0] + n - 1 > bloco[1]:
+            self._ida()
+            ultimo = self._contadores.get(sap, 0)
+            # Estende o bloco se ninguém reservou depois dele; senão a sobra é pulada
+            if bloco is None or bloco[1] != ultimo: bloco = self._blocos[sap] = [ultimo + 1, ultimo]
+            bloco[1] = self._contadores[sap] = bloco[0] + max(n, self.tamanho_bloco) - 1
+        inicio = bloco[0]
+        bloco[0] += n
+        return inicio
+
+    def salvar(self, itens):
+        agora = datetime.now(timezone.utc)
+        proximos, lotes_gerados, novos = {}, [], []
+        with self._lock:
+            faixas = Counter((g, str(d['cod_sap'])) for i, d, g in itens if g and i not in self._docs)
+            for id_item, dados, grupo in itens:
+                if id_item in self._docs:
+                    lotes_gerados.append((id_item, self._docs[id_item]['lote']))
+                    continue
+                sap = str(dados['cod_sap'])
+                chave = (grupo, sap)
+                if faixas.get(chave, 0) > 1:
+                    if chave not in proximos: proximos[chave] = self._alocar(sap, faixas[chave])
+                    numero = proximos[chave]
+                    proximos[chave] += 1
+                else:
+                    numero = self._alocar(sap)
+                lote = lotes.formatar_lote(numero)
+                self._docs[id_item] = dados | {
+                    'timestamp': datetime.fromisoformat(dados['timestamp']),
+                    'gravado_em': agora,
+                    'lote': lote,
+                    'id_doc': id_item
+                }
+                novos.append(self._docs[id_item])
+                lotes_gerados.append((id_item, lote))
+            self._acumular(novos)
+        # Commit único com registros, reservas e indicadores
+        self._ida()
+        return lotes_gerados
+
+    def _pendentes_ordenados(self):
+        regs = [r for r in self._docs.values() if r.get('status_reserva') == STATUS_PENDENTE]
+        return sorted(regs, key=lambda r: (r['timestamp'], r['id_doc']), reverse=True)
+
+    def pendentes(self):
+        self._ida()
+        with self._lock:
+            return self._copia(self._pendentes_ordenados())
+
+    def pendentes_pagina(self, tamanho=TAMANHO_PAGINA_PENDENTES, apos=None):
+        # Cursor: (timestamp, id_doc) do último registro da página anterior
+        self._ida()
+        with self._lock:
+            regs = self._pendentes_ordenados()
+            if apos is not None: regs = [r for r in regs if (r['timestamp'], r['id_doc']) < apos]
+            pagina = self._copia(regs[:tamanho])
+        return pagina, ((pagina[-1]['timestamp'], pagina[-1]['id_doc']) if len(pagina) == tamanho else None)
+
+    def contar_pendentes(self):
+        self._ida()
+        with self._lock:
+            return sum(1 for r in self._docs.values() if r.get('status_reserva') == STATUS_PENDENTE)
+
+    def _fatia(self, a, b, tamanho_pagina):
+        with self._lock:
+            regs = sorted((r for r in self._docs.values() if a <= r['timestamp'] < b), key=lambda r: r['timestamp'], reverse=True)
+        self._ida(max(1, -(-len(regs) // tamanho_pagina)))
+        return self._copia(regs)
+
+    def periodo(self, inicio, fim, tamanho_pagina=exportacao.TAMANHO_PAGINA, workers=exportacao.WORKERS_FATIAS, dias_fatia=exportacao.DIAS_FATIA):
+        quentes = exportacao.buscar_em_fatias(lambda a, b: self._fatia(a, b, tamanho_pagina), inicio, fim, dias_fatia, workers)
+        frios = self.frio.registros(inicio, fim, tamanho_pagina) if self.frio is not None else ()
+        yield from arquivo_frio.mesclar(quentes, frios, tamanho=tamanho_pagina)
+
+    def arquivar(self, registros, progresso=None):
+        ids = [r['id_doc'] for r in registros]
+        ok, falhas = [], []
+        for i in range(0, len(ids), TAMANHO_BATCH_ARQUIVAR):
+            self._ida()
+            with self._lock:
+                for id_doc in ids[i:i + TAMANHO_BATCH_ARQUIVAR]:
+                    reg = self._docs.get(id_doc)
+                    if reg is None:
+                        falhas.append(id_doc)
+                        continue
+                    # Só quem ainda estava pendente sai do contador de pendentes
+                    if reg.get('status_reserva') == STATUS_PENDENTE: self._acumular([reg], sinal=-1, so_pendentes=True)
+                    reg['status_reserva'] = STATUS_ARQUIVADO
+                    ok.append(id_doc)
+            if progresso: progresso(len(ok) + len(falhas), len(ids))
+        return ok, falhas
+
+    def excluir(self, id_doc):
+        self._ida()
+        with self._lock:
+            reg = self._docs.pop(id_doc, None)
+            removidos = [reg] if reg is not None else (self.frio.remover([id_doc]) if self.frio is not None else [])
+            self._acumular(removidos, sinal=-1)
+        return bool(removidos)
+
+    def contadores(self):
+        self._ida()
+        with self._lock:
+            return dict(self._contadores)
+
+    def ajustar_contador(self, cod_sap, valor):
+        self._ida()
+        with self._lock:
+            self._contadores[str(cod_sap)] = int(valor)
+            self._blocos.pop(str(cod_sap), None)
+
+    def _todos(self):
+        with self._lock:
+            regs = list(self._docs.values())
+        return regs + (list(self.frio.registros()) if self.frio is not None else [])
+
+    def indicadores_total(self):
+        self._ida()
+        with self._lock:
+            return dict(self._total)
+
+    def indicadores_periodo(self, data_inicio, data_fim):
+        # Soma os agregados diários do período (um documento por dia)
+        self._ida()
+        soma = dict.fromkeys(indicadores.CAMPOS, 0)
+        with self._lock:
+            for dia, valores in self._dias.items():
+                if data_inicio <= dia <= data_fim:
+                    for k, v in valores.items(): soma[k] += v
+        return soma
+
+    def reconstruir_indicadores(self):
+        # Reconciliação a partir dos registros brutos (memória + camada fria)
+        regs = self._todos()
+        self._ida(max(1, -(-len(regs) // exportacao.TAMANHO_PAGINA)))
+        with self._lock:
+            self._total = dict.fromkeys(indicadores.CAMPOS, 0)
+            self._dias = {}
+            self._acumular(regs)
+        return len(regs)
+
+    def expurgo_pendente(self):
+        self._ida()
+        return self._expurgando
+
+    def expurgar(self, progresso=None):
+        # A marca só sai se o expurgo terminar (interrupção deixa o aviso na tela)
+        self._expurgando = True
+        with self._lock:
+            total = len(self._docs)
+            ids = list(self._docs)
+        for i in range(0, total, operacoes_em_massa.TAMANHO_BATCH):
+            self._ida()
+            with self._lock:
+                for id_doc in ids[i:i + operacoes_em_massa.TAMANHO_BATCH]: self._docs.pop(id_doc, None)
+            if progresso: progresso(min(total, i + operacoes_em_massa.TAMANHO_BATCH), total)
+        with self._lock:
+            self._contadores.clear()
+            self._blocos.clear()
+            self._total = dict.fromkeys(indicadores.CAMPOS, 0)
+            self._dias = {}
+        if self.frio is not None: self.frio.limpar()
+        self._expurgando = False
+        return total, []
+
+    def compactar(self, dias=arquivo_frio.DIAS_QUENTE, progresso=None):
+        if not self.frio_configurado(): raise RuntimeError(arquivo_frio.ERRO_SEM_PASTA)
+        corte = datetime.now() - timedelta(days=dias)
+        with self._lock:
+            regs = [r for r in self._docs.values() if r.get('status_reserva') == STATUS_ARQUIVADO and r['timestamp'] < corte]
+        movidos = 0
+        for i in range(0, len(regs), operacoes_em_massa.TAMANHO_BATCH):
+            fatia = regs[i:i + operacoes_em_massa.TAMANHO_BATCH]
+            self._ida()
+            self.frio.gravar(fatia)
+            with self._lock:
+                for r in fatia: self._docs.pop(r['id_doc'], None)
+            movidos += len(fatia)
+            if progresso: progresso(movidos)
+        return movidos, []
+
+    def resumo_frio(self):
+        return self.frio.resumo() if self.frio is not None else []
+
+    def frio_configurado(self):
+        return self.frio is not None and self.frio.configurada()
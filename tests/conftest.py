@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+from google.cloud import firestore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import firestore_falso
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(firestore, 'transactional', firestore_falso.transactional)
+    return firestore_falso.FirestoreFalso()
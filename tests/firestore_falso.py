@@ -0,0 +1,166 @@
+import uuid
+import threading
+from datetime import datetime, timezone
+from google.api_core import exceptions
+from google.cloud import firestore
+
+# --- FIRESTORE FALSO (EM MEMÓRIA) ---
+# Só o necessário para lotes/repositorio: documentos, batches atômicos com
+# transformações (Increment, Maximum, SERVER_TIMESTAMP), transações serializadas
+# por um lock global (equivalente ao isolamento serializável do Firestore),
+# consultas where simples e pré-condição por last_update_time. Falhas de commit
+# levantam as mesmas exceções do cliente real.
+
+_OPS = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '==': lambda a, b: a == b,
+    '>=': lambda a, b: a >= b,
+    '>': lambda a, b: a > b
+}
+
+def _mesclar(atual, novo):
+    for k, v in novo.items():
+        if isinstance(v, dict):
+            _mesclar(atual.setdefault(k, {}), v)
+        elif isinstance(v, firestore.Increment):
+            atual[k] = atual.get(k, 0) + v.value
+        elif isinstance(v, firestore.Maximum):
+            atual[k] = max(atual.get(k, v.value), v.value)
+        elif v is firestore.DELETE_FIELD:
+            atual.pop(k, None)
+        elif v is firestore.SERVER_TIMESTAMP:
+            atual[k] = datetime.now(timezone.utc)
+        else:
+            atual[k] = v
+    return atual
+
+class Snapshot:
+    def __init__(self, ref, dados, update_time):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = dados is not None
+        self.update_time = update_time
+        self._dados = dados
+
+    def to_dict(self):
+        return _mesclar({}, self._dados) if self.exists else None
+
+    def get(self, campo):
+        return (self._dados or {}).get(campo)
+
+class Documento:
+    def __init__(self, db, colecao, id_doc):
+        self.db = db
+        self.colecao = colecao
+        self.id = id_doc
+        self.path = f"{colecao}/{id_doc}"
+
+    def get(self, transaction=None):
+        with self.db._lock:
+            dados, versao = self.db._docs.get(self.path, (None, None))
+            return Snapshot(self, dados, versao)
+
+    def set(self, dados, merge=False):
+        b = self.db.batch()
+        b.set(self, dados, merge=merge)
+        b.commit()
+
+    def delete(self):
+        b = self.db.batch()
+        b.delete(self)
+        b.commit()
+
+class Consulta:
+    def __init__(self, db, colecao, filtros=()):
+        self.db = db
+        self.colecao = colecao
+        self.filtros = list(filtros)
+
+    def where(self, campo, op, valor):
+        return Consulta(self.db, self.colecao, self.filtros + [(campo, _OPS[op], valor)])
+
+    def stream(self, transaction=None):
+        prefixo = f"{self.colecao}/"
+        with self.db._lock:
+            itens = [(p, d, v) for p, (d, v) in self.db._docs.items() if p.startswith(prefixo)]
+        for p, d, v in itens:
+            if all(campo in d and op(d[campo], valor) for campo, op, valor in self.filtros):
+                yield Snapshot(Documento(self.db, self.colecao, p[len(prefixo):]), d, v)
+
+class Colecao(Consulta):
+    def document(self, id_doc=None):
+        return Documento(self.db, self.colecao, id_doc or uuid.uuid4().hex)
+
+class OpcaoEscrita:
+    def __init__(self, last_update_time):
+        self.last_update_time = last_update_time
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self._ops = []
+
+    def create(self, ref, dados): self._ops.append(('create', ref, dados, None))
+    def set(self, ref, dados, merge=False): self._ops.append(('merge' if merge else 'set', ref, dados, None))
+    def update(self, ref, dados, option=None): self._ops.append(('update', ref, dados, option))
+    def delete(self, ref): self._ops.append(('delete', ref, None, None))
+
+    def commit(self):
+        # Tudo ou nada: valida todas as operações antes de aplicar
+        with self.db._lock:
+            docs = self.db._docs
+            for tipo, ref, _, opcao in self._ops:
+                existe = ref.path in docs
+                if tipo == 'create' and existe: raise exceptions.AlreadyExists(f"já existe: {ref.path}")
+                if tipo == 'update' and not existe: raise exceptions.NotFound(f"não existe: {ref.path}")
+                if opcao is not None and (not existe or docs[ref.path][1] != opcao.last_update_time):
+                    raise exceptions.FailedPrecondition(f"pré-condição: {ref.path}")
+            self.db.commits += 1
+            for tipo, ref, dados, _ in self._ops:
+                versao = self.db._relogio()
+                if tipo == 'delete': docs.pop(ref.path, None)
+                elif tipo in ('create', 'set'): docs[ref.path] = (_mesclar({}, dados), versao)
+                else: docs[ref.path] = (_mesclar(dict(docs.get(ref.path, ({}, None))[0]), dados), versao)
+        self._ops = []
+
+class Transacao(Batch):
+    pass
+
+def transactional(fn):
+    # Substitui firestore.transactional: a função roda inteira sob o lock do banco
+    def executar(transacao):
+        with transacao.db._lock:
+            resultado = fn(transacao)
+            transacao.commit()
+            return resultado
+    return executar
+
+class FirestoreFalso:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._tique = 0
+        self.commits = 0
+
+    def _relogio(self):
+        self._tique += 1
+        return datetime.fromtimestamp(1_700_000_000 + self._tique / 1e6, timezone.utc)
+
+    def collection(self, nome):
+        return Colecao(self, nome)
+
+    def batch(self):
+        return Batch(self)
+
+    def transaction(self):
+        return Transacao(self)
+
+    def write_option(self, last_update_time):
+        return OpcaoEscrita(last_update_time)
+
+    def get_all(self, refs):
+        return [r.get() for r in refs]
+
+    def dados(self, path):
+        return self._docs.get(path, (None, None))[0]
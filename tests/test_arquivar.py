@@ -0,0 +1,61 @@
+import uuid
+
+import indicadores
+import lotes
+import repositorio
+from test_lotes import _payload
+
+def _pendentes_indicador(db):
+    return indicadores.ler_total(db)['pendentes']
+
+def _registros(repo):
+    # Como a tela os lê: dicts com id_doc e atualizado_em (versão do documento)
+    return repo._dicts(repo.col.stream())
+
+def _repo(db):
+    repo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db))
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002), None) for _ in range(6)])
+    return repo
+
+def test_arquivar_desconta_pendentes_no_mesmo_commit(db):
+    repo = _repo(db)
+    assert _pendentes_indicador(db) == 6
+    commits = db.commits
+    ok, falhas = repo.arquivar(_registros(repo)[:4])
+    assert len(ok) == 4 and falhas == []
+    assert db.commits - commits == 1
+    assert _pendentes_indicador(db) == 2
+
+def test_rearquivar_registros_desatualizados_nao_desconta_de_novo(db):
+    repo = _repo(db)
+    tela = _registros(repo)
+    repo.arquivar(tela[:4])
+
+    # Segunda tela com a lista antiga: 4 já arquivados + 2 ainda pendentes
+    ok, falhas = repo.arquivar(tela)
+    assert sorted(ok) == sorted(r['id_doc'] for r in tela) and falhas == []
+    assert _pendentes_indicador(db) == 0
+
+def test_resposta_perdida_no_commit_nao_desconta_duas_vezes(db, monkeypatch):
+    repo = _repo(db)
+    batch = db.batch().__class__
+    commit_original = batch.commit
+    perdidas = []
+    def gravar_e_perder_resposta(self):
+        commit_original(self)
+        if not perdidas:
+            perdidas.append(True)
+            raise ConnectionError("timeout")
+    monkeypatch.setattr(batch, 'commit', gravar_e_perder_resposta)
+
+    ok, falhas = repo.arquivar(_registros(repo))
+    assert len(ok) == 6 and falhas == []
+    assert _pendentes_indicador(db) == 0
+
+def test_registro_excluido_continua_como_falha(db):
+    repo = _repo(db)
+    tela = _registros(repo)
+    repo.excluir(tela[0]['id_doc'])
+    ok, falhas = repo.arquivar(tela)
+    assert falhas == [tela[0]['id_doc']] and len(ok) == 5
+    assert _pendentes_indicador(db) == 0
@@ -0,0 +1,55 @@
+import uuid
+from datetime import datetime, timedelta
+
+import cache_producao
+import repositorio
+from test_repositorio_memoria import _payload
+
+def _repo(n):
+    repo = repositorio.RepositorioMemoria()
+    inicio = datetime.now() - timedelta(hours=1)
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002, inicio + timedelta(seconds=i)), None) for i in range(n)])
+    return repo
+
+def test_contagem_igual_nao_rele_paginas():
+    repo = _repo(25)
+    cache = cache_producao.CachePendentes(repo, tamanho_pagina=10)
+    regs, ha_mais = cache.visao(cache.contar())
+    assert len(regs) == 10 and ha_mais
+    idas = repo.idas
+    # Outras sessões/execuções: só a contagem vai ao servidor
+    for _ in range(3): assert cache.visao(cache.contar()) == (regs, True)
+    assert repo.idas - idas == 3
+
+def test_paginas_carregadas_sao_compartilhadas():
+    repo = _repo(25)
+    cache = cache_producao.CachePendentes(repo, tamanho_pagina=10)
+    regs, ha_mais = cache.visao(cache.contar(), paginas=3)
+    assert len(regs) == 25 and not ha_mais
+    idas = repo.idas
+    assert len(cache.visao(cache.contar(), paginas=2)[0]) == 20
+    assert repo.idas - idas == 1
+
+def test_contagem_diferente_ou_invalidacao_recarrega():
+    repo = _repo(5)
+    cache = cache_producao.CachePendentes(repo, tamanho_pagina=10)
+    regs, _ = cache.visao(cache.contar())
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002, datetime.now()), None)])
+    assert len(cache.visao(cache.contar())[0]) == 6
+
+    # Arquivar + gravar na mesma contagem: sem invalidação a tela ficaria velha
+    repo.arquivar(regs[:1])
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002, datetime.now()), None)])
+    cache.invalidar()
+    atuais = cache.visao(cache.contar())[0]
+    assert len(atuais) == 6 and regs[0]['id_doc'] not in {r['id_doc'] for r in atuais}
+
+def test_validade_expirada_recarrega(monkeypatch):
+    repo = _repo(3)
+    cache = cache_producao.CachePendentes(repo, tamanho_pagina=10, validade_s=60)
+    cache.visao(cache.contar())
+    relogio = cache_producao.time.monotonic() + 61
+    monkeypatch.setattr(cache_producao.time, 'monotonic', lambda: relogio)
+    idas = repo.idas
+    cache.visao(cache.contar())
+    assert repo.idas - idas == 2
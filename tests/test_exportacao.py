@@ -0,0 +1,243 @@
+import random
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+import exportacao
+
+# --- REFERÊNCIA: LAÇO ANTIGO (iterrows) ---
+# Copiado do app.py anterior ao montar_linhas_export, sem alterações de regra.
+def linhas_antigas(df_export):
+    lst_final_excel = []
+    for _, r in df_export.iterrows():
+        lst_final_excel.append({
+            'Lote': r.get('lote', ''),
+            'Reserva': r.get('reserva', ''),
+            'SAP': r.get('cod_sap', ''),
+            'Descrição': r.get('descricao', ''),
+            'Status': r.get('status_reserva', ''),
+            'Qtd': int(r.get('qtd', 0)),
+            'Peso Lançamento (kg)': float(r.get('peso_teorico', 0)),
+            'Comp. Real': int(r.get('tamanho_real_mm', 0)),
+            'Comp. Corte': int(r.get('tamanho_corte_mm', 0)),
+            'Data/Hora': r.get('data_hora', '')
+        })
+        if float(r.get('sucata', 0)) > 0.001:
+            lst_final_excel.append({
+                'Lote': 'VIRTUAL',
+                'Reserva': r.get('reserva', ''),
+                'SAP': r.get('cod_sap', ''),
+                'Descrição': f"SUCATA - {r.get('descricao', '')}",
+                'Status': r.get('status_reserva', ''),
+                'Qtd': 1,
+                'Peso Lançamento (kg)': float(r.get('sucata', 0)),
+                'Comp. Real': 0,
+                'Comp. Corte': 0,
+                'Data/Hora': r.get('data_hora', '')
+            })
+    return pd.DataFrame(lst_final_excel)
+
+def _registro(i, sucata, **extra):
+    reg = {
+        'lote': f"BRASA{i:05d}",
+        'reserva': str(100000 + i),
+        'cod_sap': 1100000000 + i,
+        'descricao': f"PERFIL {i}",
+        'status_reserva': 'Pendente' if i % 2 else 'Ok - Lançada',
+        'qtd': 1 + i % 3,
+        'peso_teorico': 2.5 * i,
+        'tamanho_real_mm': 6000 - i,
+        'tamanho_corte_mm': 5000 + i,
+        'data_hora': f"01/01/2026 08:{i % 60:02d}:00",
+        'sucata': sucata
+    }
+    reg.update(extra)
+    return reg
+
+def _comparar(df):
+    # check_dtype=False: o laço antigo deixava o pandas inferir os tipos (texto vira
+    # 'str' no pandas 3); o novo monta as colunas de texto como object. Os valores são
+    # os mesmos; a mudança de tipo está fixada em test_tipos_das_colunas.
+    antigo = linhas_antigas(df)
+    novo = exportacao.montar_linhas_export(df)
+    assert list(novo.columns) == exportacao.COLUNAS_EXPORT
+    assert_frame_equal(novo, antigo, check_dtype=False)
+    return novo
+
+def test_paridade_registros_completos():
+    sucatas = [0.0, 0.5, 0.0, 12.25, 0.0001, 3.0, 0.0, 0.0]
+    df = pd.DataFrame([_registro(i, s) for i, s in enumerate(sucatas)])
+    novo = _comparar(df)
+    assert (novo['Lote'] == 'VIRTUAL').sum() == 3
+
+@pytest.mark.parametrize('sucata, virtual', [
+    (0.001, False),
+    (0.0010000001, True),
+    (0.00099, False),
+    (0.0011, True)
+])
+def test_paridade_sucata_no_limite(sucata, virtual):
+    df = pd.DataFrame([_registro(1, sucata), _registro(2, 0.0)])
+    novo = _comparar(df)
+    assert (novo['Lote'] == 'VIRTUAL').any() == virtual
+
+def test_paridade_sucata_em_texto():
+    # Registros antigos gravaram sucata/pesos como texto
+    df = pd.DataFrame([_registro(1, '0.25', peso_teorico='7.5'), _registro(2, '0', peso_teorico='1')])
+    _comparar(df)
+
+@pytest.mark.parametrize('ausentes', [
+    ['sucata'],
+    ['lote', 'reserva'],
+    ['descricao', 'status_reserva', 'data_hora'],
+    ['qtd', 'peso_teorico', 'tamanho_real_mm', 'tamanho_corte_mm']
+])
+def test_paridade_colunas_ausentes(ausentes):
+    df = pd.DataFrame([_registro(i, 0.5 if i % 2 else 0.0) for i in range(6)]).drop(columns=ausentes)
+    _comparar(df)
+
+def test_tipos_das_colunas():
+    df = pd.DataFrame([_registro(i, 0.5) for i in range(3)])
+    novo = exportacao.montar_linhas_export(df)
+    texto = ['Lote', 'Reserva', 'Descrição', 'Status', 'Data/Hora']
+    assert all(novo[c].dtype == object for c in texto)
+    assert all(str(novo[c].dtype) == 'int64' for c in ['SAP', 'Qtd', 'Comp. Real', 'Comp. Corte'])
+    assert str(novo['Peso Lançamento (kg)'].dtype) == 'float64'
+
+def test_frame_vazio():
+    # Divergência intencional: o laço antigo devolvia um DataFrame sem colunas;
+    # o novo devolve as colunas do relatório com zero linhas (cabeçalho no Excel).
+    assert linhas_antigas(pd.DataFrame()).empty
+    for df in (pd.DataFrame(), None, pd.DataFrame(columns=['lote', 'sucata'])):
+        novo = exportacao.montar_linhas_export(df)
+        assert novo.empty
+        assert list(novo.columns) == exportacao.COLUNAS_EXPORT
+
+# --- BUSCA EM FATIAS ---
+INICIO = datetime(2026, 1, 1)
+FIM = datetime(2026, 1, 31, 23, 59, 59, 999999)
+US = timedelta(microseconds=1)
+
+def _fonte(passo=timedelta(hours=5)):
+    # Registros de INICIO a FIM (ambos inclusos) e buscar(a, b) em [a, b) decrescente
+    instantes = [INICIO]
+    while instantes[-1] + passo < FIM: instantes.append(instantes[-1] + passo)
+    instantes.append(FIM)
+    regs = [{'id_doc': str(i), 'timestamp': ts} for i, ts in enumerate(instantes)]
+
+    def buscar(a, b):
+        # Atraso variável por fatia: com workers > 1 elas terminam fora de ordem
+        threading.Event().wait(random.Random(a.toordinal()).random() * 0.02)
+        return sorted((r for r in regs if a <= r['timestamp'] < b), key=lambda r: r['timestamp'], reverse=True)
+
+    return regs, buscar
+
+def test_fatias_cobrem_o_periodo_sem_sobreposicao():
+    fatias = exportacao.fatias_periodo(INICIO, FIM, dias=7)
+    assert fatias[0][1] == FIM + US
+    assert fatias[-1][0] == INICIO
+    assert all(b - a <= timedelta(days=7) for a, b in fatias)
+    assert all(fatias[i][0] == fatias[i + 1][1] for i in range(len(fatias) - 1))
+    assert len(fatias) == 5
+
+def test_fatias_limites_do_periodo():
+    # Um único instante ainda gera a fatia [t, t + 1 µs)
+    assert exportacao.fatias_periodo(INICIO, INICIO) == [(INICIO, INICIO + US)]
+    assert exportacao.fatias_periodo(INICIO, INICIO + timedelta(days=7) - US, dias=7) == [(INICIO, INICIO + timedelta(days=7))]
+    assert exportacao.fatias_periodo(FIM, INICIO) == []
+
+@pytest.mark.parametrize('workers', [1, 4, 16])
+def test_busca_em_fatias_mantem_ordem_decrescente(workers):
+    regs, buscar = _fonte()
+    obtidos = list(exportacao.buscar_em_fatias(buscar, INICIO, FIM, dias=3, workers=workers))
+    esperados = sorted(regs, key=lambda r: r['timestamp'], reverse=True)
+    assert obtidos == esperados
+    assert obtidos[0]['timestamp'] == FIM and obtidos[-1]['timestamp'] == INICIO
+
+def test_fatia_que_falha_e_depois_responde(monkeypatch):
+    monkeypatch.setattr(exportacao.time, 'sleep', lambda s: None)
+    regs, buscar = _fonte()
+    chamadas, lock = [], threading.Lock()
+    alvo = exportacao.fatias_periodo(INICIO, FIM, dias=7)[2]
+
+    def instavel(a, b):
+        with lock:
+            chamadas.append((a, b))
+            if chamadas.count((a, b)) == 1 and (a, b) == alvo: raise ConnectionError("rede fora")
+        return buscar(a, b)
+
+    obtidos = list(exportacao.buscar_em_fatias(instavel, INICIO, FIM, dias=7, workers=3))
+    assert obtidos == sorted(regs, key=lambda r: r['timestamp'], reverse=True)
+    assert chamadas.count(alvo) == 2
+
+def test_fatia_esgota_tentativas_e_propaga_erro(monkeypatch):
+    esperas = []
+    monkeypatch.setattr(exportacao.time, 'sleep', esperas.append)
+    _, buscar = _fonte()
+    alvo = exportacao.fatias_periodo(INICIO, FIM, dias=7)[1]
+    tentativas = []
+
+    def quebrada(a, b):
+        if (a, b) == alvo:
+            tentativas.append(a)
+            raise ConnectionError("rede fora")
+        return buscar(a, b)
+
+    gerador = exportacao.buscar_em_fatias(quebrada, INICIO, FIM, dias=7, workers=2, tentativas=3)
+    with pytest.raises(ConnectionError): list(gerador)
+    assert len(tentativas) == 3
+    assert esperas == [0.5, 1.0]
+
+# --- EXCEL MEMORIZADO ---
+@pytest.fixture
+def cache_xlsx(monkeypatch):
+    monkeypatch.setattr(exportacao, '_cache_xlsx', exportacao.OrderedDict())
+    gerados = []
+    gerar = exportacao.gerar_xlsx
+    monkeypatch.setattr(exportacao, 'gerar_xlsx', lambda *a: gerados.append(a[1]) or gerar(*a))
+    return gerados
+
+def _pendentes(n, versao=1):
+    return [_registro(i, 0.0) | {'id_doc': f"doc{i}", 'atualizado_em': datetime(2026, 1, versao)} for i in range(n)]
+
+def test_xlsx_memorizado_pela_impressao_digital(cache_xlsx):
+    dados = exportacao.xlsx_memorizado(_pendentes(3), 'Pendentes')
+    assert exportacao.xlsx_memorizado(_pendentes(3), 'Pendentes') is dados
+    assert cache_xlsx == ['Pendentes']
+
+    # Mudou a versão de um registro, o conjunto ou a planilha: gera de novo
+    alterado = _pendentes(3)
+    alterado[1]['atualizado_em'] = datetime(2026, 1, 2)
+    exportacao.xlsx_memorizado(alterado, 'Pendentes')
+    exportacao.xlsx_memorizado(_pendentes(2), 'Pendentes')
+    exportacao.xlsx_memorizado(_pendentes(3), 'Outra')
+    assert len(cache_xlsx) == 4
+    assert exportacao.xlsx_memorizado(_pendentes(3), 'Pendentes') is dados
+    assert len(cache_xlsx) == 4
+
+def test_cache_xlsx_limitado_por_quantidade(cache_xlsx, monkeypatch):
+    monkeypatch.setattr(exportacao, 'LIMITE_CACHE_XLSX', 2)
+    for chave in 'abc': exportacao._guardar(chave, b'x')
+    assert list(exportacao._cache_xlsx) == ['b', 'c']
+
+    # Um acerto renova a entrada: a menos usada recentemente é que sai
+    primeiro = exportacao.xlsx_memorizado(_pendentes(1), 'P')
+    exportacao.xlsx_memorizado(_pendentes(2), 'P')
+    assert exportacao.xlsx_memorizado(_pendentes(1), 'P') is primeiro
+    exportacao.xlsx_memorizado(_pendentes(3), 'P')
+    assert exportacao.xlsx_memorizado(_pendentes(1), 'P') is primeiro
+    assert len(cache_xlsx) == 3
+    assert len(exportacao._cache_xlsx) == 2
+
+def test_cache_xlsx_limitado_por_bytes(cache_xlsx, monkeypatch):
+    monkeypatch.setattr(exportacao, 'LIMITE_CACHE_BYTES', 10)
+    exportacao._guardar('a', b'x' * 4)
+    exportacao._guardar('b', b'x' * 4)
+    exportacao._guardar('c', b'x' * 4)
+    assert list(exportacao._cache_xlsx) == ['b', 'c']
+    # Arquivo maior que o limite fica sozinho (o último gerado sempre é guardado)
+    exportacao._guardar('d', b'x' * 20)
+    assert list(exportacao._cache_xlsx) == ['d']
@@ -0,0 +1,34 @@
+import fila_local
+
+def _fila(tmp_path, enviar):
+    return fila_local.FilaLocal(str(tmp_path / "fila.db"), enviar)
+
+def test_descarregar_guarda_lotes_confirmados(tmp_path):
+    enviados = []
+    def enviar(itens):
+        enviados.extend(itens)
+        return [(i, f"BRASA{n:05d}") for n, (i, _, _) in enumerate(itens, 1)]
+
+    fila = _fila(tmp_path, enviar)
+    a = fila.enfileirar({'cod_sap': 1})
+    grupo = fila.enfileirar_grupo([{'cod_sap': 2}, {'cod_sap': 2}])
+    assert fila.lotes_confirmados([a] + grupo) == {}
+
+    assert fila.descarregar() == 3
+    assert fila.tamanho() == 0
+    assert fila.lotes_confirmados([a] + grupo + ['outro']) == {a: 'BRASA00001', grupo[0]: 'BRASA00002', grupo[1]: 'BRASA00003'}
+
+def test_falha_no_envio_nao_confirma(tmp_path):
+    def enviar(itens): raise ConnectionError("rede fora")
+    fila = _fila(tmp_path, enviar)
+    a = fila.enfileirar({'cod_sap': 1})
+    assert fila.descarregar() == 0
+    assert fila.ultimo_erro == "rede fora"
+    assert fila.tamanho() == 1 and fila.lotes_confirmados([a]) == {}
+
+def test_confirmados_limitados(tmp_path, monkeypatch):
+    monkeypatch.setattr(fila_local, 'LIMITE_CONFIRMADOS', 3)
+    fila = _fila(tmp_path, lambda itens: [(i, i) for i, _, _ in itens])
+    ids = [fila.enfileirar({'n': n}) for n in range(5)]
+    fila.descarregar()
+    assert list(fila.lotes_confirmados(ids)) == ids[2:]
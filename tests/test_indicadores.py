@@ -0,0 +1,88 @@
+import uuid
+
+import pytest
+
+import indicadores
+import lotes
+import repositorio
+from test_lotes import _payload
+
+@pytest.fixture
+def repo(db, monkeypatch):
+    monkeypatch.setattr(indicadores, 'CACHE_MARCA_S', 0)
+    repo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db))
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002 + i % 2), None) for i in range(6)])
+    return repo
+
+def _reconstruir(repo, **kw):
+    return indicadores.reconstruir(repo.db, espera_s=0, **kw)
+
+def test_reconstrucao_sobrescreve_sem_zerar_o_painel(repo):
+    db = repo.db
+    # Agregado divergente e um dia que não existe mais nos registros
+    db.collection(indicadores.COLECAO).document('total').set({'registros': 99}, merge=True)
+    db.collection(indicadores.COLECAO).document('dia_20000101').set({'registros': 3, 'tipo': 'dia', 'data': '2000-01-01'})
+    vistos = []
+
+    def extras():
+        # Meio da reconstrução: o painel ainda mostra os valores antigos, não zeros
+        vistos.append(indicadores.ler_total(db)['registros'])
+        yield from ()
+
+    assert _reconstruir(repo, extras=extras()) == 6
+    assert vistos == [99]
+    assert indicadores.ler_total(db)['registros'] == 6
+    assert db.dados(f"{indicadores.COLECAO}/dia_20000101") is None
+    total = db.dados(f"{indicadores.COLECAO}/total")
+    assert total.get('reconstruido_em') is not None and 'reconstrucao_expira_em' not in total
+
+def test_gravacoes_recusadas_durante_a_reconstrucao(repo):
+    db = repo.db
+    tentativas = []
+
+    def extras():
+        for metodo in (lambda: repo.salvar([(uuid.uuid4().hex, _payload(1100000002), None)]),
+                       lambda: repo.arquivar(repo._dicts(repo.col.stream())[:1]),
+                       lambda: _reconstruir(repo)):
+            with pytest.raises(RuntimeError): metodo()
+            tentativas.append(True)
+        yield from ()
+
+    _reconstruir(repo, extras=extras())
+    assert len(tentativas) == 3
+    assert indicadores.ler_total(db)['registros'] == 6
+    # Terminada a reconstrução, a gravação passa e soma nos agregados
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002), None)])
+    assert indicadores.ler_total(db)['registros'] == 7
+
+def test_falha_na_reconstrucao_libera_a_marca_e_pede_nova(repo):
+    db = repo.db
+
+    def extras():
+        raise ConnectionError("rede fora")
+        yield
+
+    with pytest.raises(ConnectionError): _reconstruir(repo, extras=extras())
+    total = db.dados(f"{indicadores.COLECAO}/total")
+    assert 'reconstrucao_expira_em' not in total and 'reconstruido_em' not in total
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002), None)])
+
+def test_base_anterior_aos_agregados_reconstroi_uma_vez(db, monkeypatch):
+    monkeypatch.setattr(indicadores, 'ESPERA_GRAVADORES_S', 0)
+    repo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db))
+    # Registros gravados antes dos agregados existirem; depois, um arquivamento já
+    # com agregados deixaria 'pendentes' negativo sem a reconstrução
+    for i in range(4):
+        db.collection(repositorio.COLECAO).document(f"antigo{i}").set(repo._payload(_payload(1100000002), i + 1))
+    repo.arquivar(repo._dicts(repo.col.stream())[:2])
+    assert indicadores.ler_total(db)['pendentes'] == -2
+
+    assert indicadores.reconstruir_se_necessario(db) == 4
+    total = indicadores.ler_total(db)
+    assert total['registros'] == 4 and total['pendentes'] == 2
+    assert indicadores.reconstruir_se_necessario(db) is None
+
+def test_limpeza_do_expurgo_deixa_agregados_validos(repo):
+    indicadores.limpar(repo.db)
+    assert indicadores.ler_total(repo.db)['registros'] == 0
+    assert indicadores.reconstruir_se_necessario(repo.db) is None
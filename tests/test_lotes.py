@@ -0,0 +1,196 @@
+import uuid
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import lotes
+import firestore_falso
+import repositorio
+
+SAPS = [1100000002, 1100000003]
+
+def _payload(sap):
+    return {
+        'data_hora': '01/01/2026 08:00:00',
+        'timestamp': '2026-01-01T08:00:00',
+        'reserva': '123456',
+        'status_reserva': 'Pendente',
+        'cod_sap': sap,
+        'descricao': 'PERFIL TESTE',
+        'qtd': 1,
+        'peso_real': 1.0,
+        'tamanho_real_mm': 1000,
+        'tamanho_corte_mm': 1000,
+        'peso_teorico': 1.0,
+        'sucata': 0.0
+    }
+
+def _contador(db, sap):
+    return (db.dados(f"{lotes.COL_CONTROLES}/{lotes.DOC_CONTADOR}") or {}).get(str(sap), 0)
+
+def _reservas(db):
+    return [d.to_dict() for d in db.collection(lotes.COL_RESERVAS).stream()]
+
+def _lotes_gravados(db):
+    return [d.to_dict() for d in db.collection(repositorio.COLECAO).stream()]
+
+def test_salvar_em_paralelo_nao_duplica_lotes(db):
+    # Vários "processos" (um alocador cada) gravando em paralelo, com blocos pequenos
+    # para forçar muitas reservas concorrentes no contador
+    repos = [repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=3)) for _ in range(4)]
+    aleatorio = random.Random(7)
+    trabalhos = [(repos[i % len(repos)], aleatorio.choice(SAPS)) for i in range(400)]
+
+    def gravar(trabalho):
+        repo, sap = trabalho
+        return repo.salvar([(uuid.uuid4().hex, _payload(sap), None)])
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(gravar, trabalhos))
+
+    gravados = _lotes_gravados(db)
+    assert len(gravados) == 400
+    for sap in SAPS:
+        numeros = Counter(r['lote'] for r in gravados if r['cod_sap'] == sap)
+        assert numeros and max(numeros.values()) == 1
+
+def test_alocar_em_paralelo_no_mesmo_processo(db):
+    alocador = lotes.AlocadorLotes(db, tamanho_bloco=5)
+    numeros, lock = [], threading.Lock()
+
+    def alocar(_):
+        numero, _ = alocador.alocar(SAPS[0])
+        with lock: numeros.append(numero)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(alocar, range(200)))
+    assert sorted(numeros) == list(range(1, 201))
+
+def test_faixa_de_grupo_e_contigua_e_nao_colide(db):
+    repo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=5))
+    outro = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=5))
+    sap = SAPS[0]
+
+    repo.salvar([(uuid.uuid4().hex, _payload(sap), None) for _ in range(3)])
+    # Flush comum com SAP repetido continua no bloco reservado (sem nova reserva)
+    assert len(_reservas(db)) == 1
+
+    grupo = repo.salvar([(uuid.uuid4().hex, _payload(sap), 'g1') for _ in range(4)])
+    assert [l for _, l in grupo] == [lotes.formatar_lote(n) for n in range(4, 8)]
+    # A reserva foi estendida, não substituída
+    assert len(_reservas(db)) == 1
+
+    outro.salvar([(uuid.uuid4().hex, _payload(sap), None)])
+    grupo = repo.salvar([(uuid.uuid4().hex, _payload(sap), 'g2') for _ in range(9)])
+    numeros = [int(l[5:]) for _, l in grupo]
+    assert numeros == list(range(numeros[0], numeros[0] + 9))
+
+    todos = Counter(r['lote'] for r in _lotes_gravados(db))
+    assert max(todos.values()) == 1
+
+def test_devolver_retorna_sobra_ao_contador(db):
+    repo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=10))
+    repo.salvar([(uuid.uuid4().hex, _payload(SAPS[0]), None) for _ in range(3)])
+    assert _contador(db, SAPS[0]) == 10
+
+    repo.alocador.devolver()
+    assert _contador(db, SAPS[0]) == 3
+    assert _reservas(db) == []
+
+    novo = lotes.AlocadorLotes(db, tamanho_bloco=10)
+    assert novo.alocar(SAPS[0])[0] == 4
+
+def test_devolver_pula_sobra_se_outro_reservou_depois(db):
+    primeiro = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=10))
+    primeiro.salvar([(uuid.uuid4().hex, _payload(SAPS[0]), None)])
+    segundo = lotes.AlocadorLotes(db, tamanho_bloco=10)
+    assert segundo.alocar(SAPS[0])[0] == 11
+
+    primeiro.alocador.devolver()
+    # Números 2..10 são pulados: o contador não pode voltar para trás do segundo bloco
+    assert _contador(db, SAPS[0]) == 20
+    assert len(_reservas(db)) == 1
+
+def test_recuperar_reservas_expiradas(db):
+    # Processo que "caiu" (reserva com validade vencida há 30 min) e outro ativo
+    caido = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=10))
+    caido.salvar([(uuid.uuid4().hex, _payload(SAPS[0]), None) for _ in range(2)])
+    vencida = datetime.now(timezone.utc) - timedelta(minutes=30)
+    for d in db.collection(lotes.COL_RESERVAS).stream():
+        d.reference.set({'expira_em': vencida}, merge=True)
+    ativo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=10))
+    ativo.salvar([(uuid.uuid4().hex, _payload(SAPS[1]), None)])
+
+    assert lotes.recuperar_reservas_expiradas(db) == 1
+    assert _contador(db, SAPS[0]) == 2
+    assert _contador(db, SAPS[1]) == 10
+    assert [r['cod_sap'] for r in _reservas(db)] == [str(SAPS[1])]
+
+def test_falha_no_commit_nao_reaproveita_numeros(db, monkeypatch):
+    repo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=10))
+    repo.salvar([(uuid.uuid4().hex, _payload(SAPS[0]), None)])
+
+    commit_original = db.batch().__class__.commit
+    def falhar(self): raise ConnectionError("rede fora")
+    monkeypatch.setattr(db.batch().__class__, 'commit', falhar)
+    item = (uuid.uuid4().hex, _payload(SAPS[0]), None)
+    try: repo.salvar([item])
+    except ConnectionError: pass
+    monkeypatch.setattr(db.batch().__class__, 'commit', commit_original)
+
+    # O bloco foi descartado: a nova tentativa usa um bloco novo, sem repetir números
+    repo.salvar([item])
+    todos = Counter(r['lote'] for r in _lotes_gravados(db))
+    assert len(todos) == 2 and max(todos.values()) == 1
+
+def test_reenvio_apos_perda_de_confirmacao_devolve_lotes_gravados(db, monkeypatch):
+    repo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=10))
+    batch = db.batch().__class__
+    commit_original = batch.commit
+    def gravar_e_perder_resposta(self):
+        commit_original(self)
+        raise ConnectionError("timeout")
+
+    gravado = (uuid.uuid4().hex, _payload(SAPS[0]), None)
+    # Só o batch da gravação perde a resposta; a transação da reserva funciona
+    monkeypatch.setattr(firestore_falso.Transacao, 'commit', commit_original)
+    monkeypatch.setattr(batch, 'commit', gravar_e_perder_resposta)
+    assert repo.salvar([gravado]) == [(gravado[0], 'BRASA00001')]
+    monkeypatch.setattr(batch, 'commit', commit_original)
+
+    novo = (uuid.uuid4().hex, _payload(SAPS[0]), None)
+    confirmados = repo.salvar([gravado, novo])
+    assert [i for i, _ in confirmados] == [gravado[0], novo[0]]
+    assert confirmados[0][1] == 'BRASA00001'
+    assert confirmados[1][1] not in ('BRASA00001', None)
+    assert len(_lotes_gravados(db)) == 2
+
+def test_ajuste_do_contador_encerra_reservas_abertas(db):
+    sap = SAPS[0]
+    processo = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=20))
+    processo.salvar([(uuid.uuid4().hex, _payload(sap), None) for _ in range(25)])
+    # Reserva aberta 21..40 usada até 25; o admin recua o contador um bloco
+    assert _contador(db, sap) == 40
+    admin = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db))
+    admin.ajustar_contador(sap, 20)
+    assert [r for r in _reservas(db) if r['cod_sap'] == str(sap)] == []
+
+    outro = repositorio.RepositorioFirestore(db, lotes.AlocadorLotes(db, tamanho_bloco=20))
+    outro.salvar([(uuid.uuid4().hex, _payload(sap), None) for _ in range(10)])
+    assert _contador(db, sap) == 40
+
+    # Antes, a reserva antiga (fim 40) vencia e devolvia o contador para 25
+    vencida = datetime.now(timezone.utc) - timedelta(minutes=30)
+    for d in db.collection(lotes.COL_RESERVAS).stream():
+        if d.to_dict()['inicio'] == 21 and d.to_dict()['usado_ate'] == 25: d.reference.set({'expira_em': vencida}, merge=True)
+    lotes.recuperar_reservas_expiradas(db)
+    assert _contador(db, sap) == 40
+    assert lotes.AlocadorLotes(db).alocar(sap)[0] == 41
+
+    # O processo com bloco antigo em memória não reaproveita 26..40: reserva de novo
+    try: processo.salvar([(uuid.uuid4().hex, _payload(sap), None)])
+    except Exception: processo.salvar([(uuid.uuid4().hex, _payload(sap), None)])
+    depois_do_ajuste = Counter(r['lote'] for r in _lotes_gravados(db) if int(r['lote'][5:]) > 25)
+    assert max(depois_do_ajuste.values()) == 1
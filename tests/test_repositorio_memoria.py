@@ -0,0 +1,92 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import arquivo_frio
+import indicadores
+import repositorio
+
+def _payload(sap, ts, **extra):
+    return {
+        'data_hora': ts.strftime("%d/%m/%Y %H:%M:%S"),
+        'timestamp': ts.isoformat(),
+        'reserva': '123456',
+        'status_reserva': 'Pendente',
+        'cod_sap': sap,
+        'descricao': 'PERFIL TESTE',
+        'qtd': 2,
+        'peso_real': 10.5,
+        'tamanho_real_mm': 3120,
+        'tamanho_corte_mm': 3000,
+        'peso_teorico': 10.2,
+        'sucata': 0.3
+    } | extra
+
+def _aproximado(a, b):
+    return {k: pytest.approx(v) for k, v in a.items()} == b
+
+@pytest.fixture
+def repo(tmp_path):
+    return repositorio.RepositorioMemoria(frio=arquivo_frio.ArquivoFrio(str(tmp_path / "frio")), tamanho_bloco=5)
+
+def test_repositorio_e_abstrato():
+    with pytest.raises(TypeError): repositorio.Repositorio()
+
+def test_indicadores_na_escrita_batem_com_reconstrucao(repo):
+    antigo = datetime.now() - timedelta(days=200)
+    itens = [(uuid.uuid4().hex, _payload(1100000002 + i % 3, antigo + timedelta(hours=i), qtd=1 + i % 4), None) for i in range(30)]
+    repo.salvar(itens)
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002, datetime.now()), 'g') for _ in range(4)])
+
+    regs = repo.pendentes()
+    repo.arquivar(regs[:20])
+    # Registros desatualizados arquivados de novo não descontam pendentes outra vez
+    repo.arquivar(regs[:10])
+    repo.excluir(regs[25]['id_doc'])
+    movidos, _ = repo.compactar(dias=90)
+    assert movidos > 0
+    repo.excluir(regs[-1]['id_doc'])
+
+    total = repo.indicadores_total()
+    assert total['registros'] == 32
+    assert total['pendentes'] == repo.contar_pendentes() == 12
+    hoje = datetime.now().date()
+    periodo = repo.indicadores_periodo(hoje - timedelta(days=1), hoje)
+    # Os 4 de hoje são os mais recentes: estavam na parte arquivada
+    assert periodo['registros'] == 4 and periodo['pendentes'] == 0
+
+    assert repo.reconstruir_indicadores() == 32
+    assert _aproximado(total, repo.indicadores_total())
+
+def test_lotes_saem_de_blocos_reservados(repo):
+    agora = datetime.now()
+    idas = repo.idas
+    for _ in range(12): repo.salvar([(uuid.uuid4().hex, _payload(1100000002, agora), None)])
+    # 12 commits + 3 reservas de bloco (5 números cada)
+    assert repo.idas - idas == 15
+    assert repo.contadores() == {'1100000002': 15}
+
+    grupo = repo.salvar([(uuid.uuid4().hex, _payload(1100000002, agora), 'g') for _ in range(7)])
+    numeros = [int(l[5:]) for _, l in grupo]
+    assert numeros == list(range(13, 20))
+
+def test_expurgo_pendente_ate_terminar(repo):
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002, datetime.now()), None)])
+    vistos = []
+    repo.expurgar(progresso=lambda n, t: vistos.append(repo.expurgo_pendente()))
+    assert vistos == [True]
+    assert not repo.expurgo_pendente()
+    assert repo.indicadores_total() == dict.fromkeys(indicadores.CAMPOS, 0)
+
+def test_compactar_recusado_sem_pasta_da_camada_fria(monkeypatch):
+    sem_pasta = arquivo_frio.ArquivoFrio(None)
+    assert not sem_pasta.configurada() and sem_pasta.meses() == []
+    with pytest.raises(RuntimeError): sem_pasta.gravar([])
+
+    repo = repositorio.RepositorioMemoria(frio=sem_pasta)
+    antigo = datetime.now() - timedelta(days=200)
+    repo.salvar([(uuid.uuid4().hex, _payload(1100000002, antigo, status_reserva=repositorio.STATUS_ARQUIVADO), None)])
+    assert not repo.frio_configurado()
+    with pytest.raises(RuntimeError): repo.compactar(dias=90)
+    assert repo.contar_pendentes() == 0 and repo.indicadores_total()['registros'] == 1